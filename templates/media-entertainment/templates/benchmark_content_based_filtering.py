@@ -0,0 +1,865 @@
+"""
+Benchmark for the Content-Based Filtering Template
+Measures per-query top-k selection latency and data preparation time at
+catalog scale, and runs an end-to-end suite (fit time, peak memory, query
+latency, batch throughput, serving process startup) whose JSON results can
+be compared between commits
+"""
+
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'content-based-filtering-template.py')
+
+
+def load_template():
+    """Load the template module (its file name is not importable directly)"""
+    spec = importlib.util.spec_from_file_location('content_based_filtering_template',
+                                                  TEMPLATE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so worker processes can unpickle the module's functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _percentiles(timings):
+    """Return p50/p99 latency in milliseconds"""
+    timings_ms = np.asarray(timings) * 1000
+    return {
+        'p50_ms': float(np.percentile(timings_ms, 50)),
+        'p99_ms': float(np.percentile(timings_ms, 99)),
+    }
+
+
+def full_sort_top_k(scores, k, exclude):
+    """Selection path used before partial top-k: mask, full argsort, slice"""
+    scores[exclude] = -1
+    top_indices = np.argsort(scores)[::-1][:k]
+    return top_indices, scores[top_indices]
+
+
+def benchmark_top_k(module, n_items, n_queries=50, k=10, n_seen=50, seed=0):
+    """
+    Compare full-sort and partial top-k selection on random score vectors
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        n_queries (int): Number of timed queries per method
+        k (int): Results per query
+        n_seen (int): Seen items masked out per query
+        seed (int): Random seed
+
+    Returns:
+        dict: Latency percentiles per selection method
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    for name, select in [('full_sort', full_sort_top_k),
+                         ('partial_top_k', module._top_k)]:
+        timings = []
+        for _ in range(n_queries):
+            scores = rng.random(n_items)
+            exclude = rng.choice(n_items, n_seen, replace=False)
+
+            start = time.perf_counter()
+            select(scores, k, exclude)
+            timings.append(time.perf_counter() - start)
+
+        results[name] = _percentiles(timings)
+
+    return results
+
+
+def make_catalog(n_items, seed=0, n_topics=0, topic_share=0.8):
+    """
+    Synthetic catalog shaped like a CSV export: genres are list literals
+
+    Args:
+        n_items (int): Number of items
+        seed (int): Random seed
+        n_topics (int): If set, every item belongs to one of n_topics
+            topics and draws topic_share of its words from that topic's
+            slice of the vocabulary, giving the text the low-rank structure
+            of real descriptions (default: uniformly random words)
+        topic_share (float): Share of words drawn from the item's topic
+
+    Returns:
+        pd.DataFrame: Content metadata accepted by prepare_content_data
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f'word{i}' for i in range(2000)])
+    genres = np.array(['Action', 'Comedy', 'Crime', 'Drama', 'Horror', 'Romance',
+                       'Sci-Fi', 'Thriller', 'Animation', 'Documentary'])
+
+    word_ids = rng.integers(0, len(vocabulary), (n_items, 12))
+    if n_topics:
+        topic_size = len(vocabulary) // n_topics
+        topics = rng.integers(0, n_topics, n_items)
+        in_topic = rng.random((n_items, 12)) < topic_share
+        topic_words = topics[:, None] * topic_size + rng.integers(0, topic_size, (n_items, 12))
+        word_ids = np.where(in_topic, topic_words, word_ids)
+    words = vocabulary[word_ids]
+    genre_picks = genres[rng.integers(0, len(genres), (n_items, 2))]
+
+    return pd.DataFrame({
+        'content_id': np.arange(n_items),
+        'title': [' '.join(row) for row in words[:, :3]],
+        'description': [' '.join(row) for row in words[:, 3:]],
+        'genres': [f"['{a}', '{b}']" for a, b in genre_picks],
+        'year': rng.integers(1950, 2025, n_items),
+        'rating': rng.uniform(1, 10, n_items).round(1),
+    })
+
+
+def legacy_prepare_columns(content_df):
+    """Row-wise text concatenation and eval genre parsing used before"""
+    content_df = content_df.copy()
+    combined_text = content_df[['title', 'description']].fillna('').apply(
+        lambda x: ' '.join(x), axis=1)
+    genres = content_df['genres'].apply(lambda x: eval(x) if isinstance(x, str) else x)
+    genres = genres.apply(lambda x: x if isinstance(x, list) else [x])
+    return combined_text, genres
+
+
+def vectorized_prepare_columns(module, content_df):
+    """Column-wise text concatenation and eval-free genre parsing"""
+    combined_text = content_df['title'].fillna('').astype(str).str.cat(
+        content_df['description'].fillna('').astype(str), sep=' ')
+    labels = module._parse_label_column(content_df['genres'])
+    return combined_text, labels
+
+
+def benchmark_preparation(module, n_items, repeats=3):
+    """
+    Compare the legacy and vectorized column preparation on one catalog
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        repeats (int): Timed runs per method (best is reported)
+
+    Returns:
+        dict: Best wall time in seconds per preparation method
+    """
+    content_df = make_catalog(n_items)
+    results = {}
+
+    for name, prepare in [('legacy', legacy_prepare_columns),
+                          ('vectorized', lambda df: vectorized_prepare_columns(module, df))]:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            prepare(content_df)
+            timings.append(time.perf_counter() - start)
+        results[name] = {'best_s': min(timings)}
+
+    return results
+
+
+def make_profiles(content_ids, n_profiles, n_liked=5, n_disliked=2, seed=0):
+    """
+    Random user profiles over a catalog
+
+    Args:
+        content_ids (np.ndarray): Catalog content IDs
+        n_profiles (int): Number of profiles
+        n_liked (int): Liked items per profile
+        n_disliked (int): Disliked items per profile
+        seed (int): Random seed
+
+    Returns:
+        list: Profiles accepted by recommend_content
+    """
+    rng = np.random.default_rng(seed)
+    picks = content_ids[rng.integers(0, len(content_ids), (n_profiles, n_liked + n_disliked))]
+    return [{'liked_content': row[:n_liked].tolist(),
+             'disliked_content': row[n_liked:].tolist()} for row in picks]
+
+
+def _latency(func, args_list):
+    """Time func(*args) for every argument tuple and return percentiles"""
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return _percentiles(timings)
+
+
+def benchmark_reduction(module, n_items, dims=(64, 128, 256), n_queries=200, k=10,
+                        n_topics=100, seed=0):
+    """
+    Compare scoring in the full sparse feature space with truncated SVD
+    reductions of it
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        dims (list): Reduction dimensions
+        n_queries (int): Queries per method
+        k (int): Results per query
+        n_topics (int): Topics of the synthetic text (see make_catalog)
+        seed (int): Random seed
+
+    Returns:
+        dict: Per method the feature bytes, fit time and latency
+            percentiles; reduced methods also report recall@k against the
+            full space and the share of the full top k found in their top
+            10 x k
+    """
+    content_df = make_catalog(n_items, seed, n_topics=n_topics)
+    profiles = make_profiles(content_df['content_id'].to_numpy(), n_queries, seed=seed)
+
+    def run(recommender):
+        start = time.perf_counter()
+        recommender.prepare_content_data(content_df)
+        stats = {'fit_s': time.perf_counter() - start,
+                 'feature_bytes': module._nbytes(recommender.content_features)}
+        stats.update(_latency(recommender.recommend_content,
+                              [(profile, k) for profile in profiles]))
+        return recommender, stats
+
+    expected, results = {}, {}
+    recommender, results['full'] = run(module.ContentBasedRecommender(sparse=True))
+    n_columns = recommender.content_features.shape[1]
+    results['full']['dense_feature_bytes'] = n_items * n_columns * 4
+    for profile in profiles:
+        expected[id(profile)] = {content_id for content_id, _ in
+                             recommender.recommend_content(profile, k)}
+
+    for dim in dims:
+        recommender, stats = run(module.ContentBasedRecommender(sparse=True,
+                                                                 reduction_dim=dim))
+        found = found_shortlist = 0
+        for profile in profiles:
+            ranked = [content_id for content_id, _ in
+                      recommender.recommend_content(profile, 10 * k)]
+            found += len(expected[id(profile)] & set(ranked[:k]))
+            found_shortlist += len(expected[id(profile)] & set(ranked))
+        n_expected = sum(len(ids) for ids in expected.values())
+        stats['recall_at_k'] = found / n_expected
+        stats['recall_at_10k'] = found_shortlist / n_expected
+        results[f'svd{dim}'] = stats
+
+    return results
+
+
+def benchmark_sharded(module, n_items, n_shards=4, n_queries=200, k=10, batch_users=1024,
+                      seed=0):
+    """
+    Compare one recommender with a ShardedRecommender over n_shards local
+    worker processes
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        n_shards (int): Shard worker processes
+        n_queries (int): Timed single queries per method
+        k (int): Results per query
+        batch_users (int): Profiles scored by recommend_content_batch
+        seed (int): Random seed
+
+    Returns:
+        dict: Latency percentiles and batch throughput per method, and
+            whether the sharded results match
+    """
+    content_df = make_catalog(n_items, seed)
+    profiles = make_profiles(content_df['content_id'].to_numpy(),
+                             max(n_queries, batch_users), seed=seed)
+    recommender = module.ContentBasedRecommender(sparse=True)
+    recommender.prepare_content_data(content_df)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        with module.ShardedRecommender.launch(recommender, n_shards, path) as sharded:
+            for name, target in (('single', recommender), ('sharded', sharded)):
+                results[name] = _latency(target.recommend_content,
+                                         [(profile, k) for profile in profiles[:n_queries]])
+                start = time.perf_counter()
+                target.recommend_content_batch(profiles[:batch_users], k)
+                results[name]['batch_users_per_s'] = (
+                    batch_users / (time.perf_counter() - start))
+
+            results['agree'] = all(
+                [content_id for content_id, _ in sharded.recommend_content(profile, k)]
+                == [content_id for content_id, _ in recommender.recommend_content(profile, k)]
+                for profile in profiles[:20])
+
+    return results
+
+
+def benchmark_registry(module, n_items, n_projects=20, resident_projects=5,
+                       n_requests=1000, k=10, seed=0):
+    """
+    Serve skewed traffic over n_projects saved models through a
+    RecommenderRegistry whose budget holds about resident_projects of them
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size of every project
+        n_projects (int): Projects saved to disk
+        resident_projects (int): Memory budget in average project sizes
+        n_requests (int): Requests, each to a Zipf-distributed project
+        k (int): Results per request
+        seed (int): Random seed
+
+    Returns:
+        dict: Mean fit time, load latency percentiles, hit rate, request
+            latency percentiles and the registry stats
+    """
+    rng = np.random.default_rng(seed)
+    profiles = {}
+    fit_seconds = []
+    sizes = []
+    with tempfile.TemporaryDirectory() as root:
+        for project in range(n_projects):
+            content_df = make_catalog(n_items, seed + project)
+            profiles[project] = make_profiles(content_df['content_id'].to_numpy(), 50,
+                                              seed=seed + project)
+            start = time.perf_counter()
+            recommender = module.ContentBasedRecommender(sparse=True)
+            recommender.prepare_content_data(content_df)
+            fit_seconds.append(time.perf_counter() - start)
+            sizes.append(recommender.memory_usage())
+            recommender.save(os.path.join(root, f'project_{project}'))
+            del recommender
+
+        registry = module.RecommenderRegistry(
+            root, memory_budget=int(resident_projects * np.mean(sizes)))
+        # Project p is requested with probability ~ 1 / (p + 1)
+        weights = 1.0 / np.arange(1, n_projects + 1)
+        projects = rng.choice(n_projects, n_requests, p=weights / weights.sum())
+
+        def request(project):
+            profile = profiles[project][rng.integers(len(profiles[project]))]
+            registry.get(f'project_{project}').recommend_content(profile, k)
+
+        results = _latency(request, [(project,) for project in projects])
+        latencies = np.array(registry.load_latencies) * 1000
+        results.update({
+            'fit_mean_s': float(np.mean(fit_seconds)),
+            'load_p50_ms': float(np.percentile(latencies, 50)),
+            'load_p99_ms': float(np.percentile(latencies, 99)),
+            'hit_rate': registry.stats['hits'] / n_requests,
+            'stats': dict(registry.stats),
+        })
+        del registry
+
+    return results
+
+
+# Run in a fresh interpreter by benchmark_startup; prints one JSON line
+_STARTUP_SCRIPT = """
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('content_based_filtering', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+recommender = module.ContentBasedRecommender.load(sys.argv[2])
+loaded = time.perf_counter()
+recommender.recommend_content(json.loads(sys.argv[3]), int(sys.argv[4]))
+queried = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'first_query_s': queried - loaded,
+    'total_s': queried - start,
+    'modules': [name for name in ('pandas', 'scipy', 'sklearn') if name in sys.modules],
+}))
+"""
+
+
+def benchmark_startup(model_path, profile, k=10, repeats=3):
+    """
+    Cold-start time of a serving process: import the template, load a saved
+    model memory-mapped and answer one query
+
+    Args:
+        model_path (str): Directory written by ContentBasedRecommender.save
+        profile (dict): User profile of the first query
+        k (int): Results of the first query
+        repeats (int): Fresh interpreters started; the fastest one is kept
+
+    Returns:
+        dict: Seconds per phase, plus the heavy modules the process imported
+    """
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, '-c', _STARTUP_SCRIPT, TEMPLATE_PATH, model_path,
+             json.dumps(profile), str(k)],
+            capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return min(runs, key=lambda run: run['total_s'])
+
+
+def benchmark_catalog(n_items, n_queries=200, k=10, batch_users=1024, sparse=True,
+                      neighbor_top_k=10, neighbor_max_items=100_000, seed=0):
+    """
+    End-to-end benchmark of one synthetic catalog
+
+    Meant to run in a fresh process (see run_suite) so the peak RSS
+    belongs to this catalog alone.
+
+    Args:
+        n_items (int): Catalog size
+        n_queries (int): Timed single queries per method
+        k (int): Results per query
+        batch_users (int): Profiles scored by recommend_content_batch
+        sparse (bool): Fit the recommender in sparse mode
+        neighbor_top_k (int): Neighbors per item for get_similar_content
+        neighbor_max_items (int): Largest catalog for which the top-K
+            neighbor index is built (its cost grows with N^2)
+        seed (int): Random seed
+
+    Returns:
+        dict: Timings in seconds, latencies in milliseconds, memory in bytes
+    """
+    module = load_template()
+    content_df = make_catalog(n_items, seed)
+    content_ids = content_df['content_id'].to_numpy()
+    profiles = make_profiles(content_ids, max(n_queries, batch_users), seed=seed)
+    rng = np.random.default_rng(seed)
+
+    recommender = module.ContentBasedRecommender(sparse=sparse)
+    results = {'n_items': n_items, 'rss_before_fit_bytes': module._peak_rss()}
+
+    start = time.perf_counter()
+    recommender.prepare_content_data(content_df)
+    results['fit_s'] = time.perf_counter() - start
+    results['fit_peak_rss_bytes'] = module._peak_rss()
+    results['feature_shape'] = list(recommender.content_features.shape)
+    results['feature_bytes'] = module._nbytes(recommender.content_features)
+
+    if n_items <= neighbor_max_items:
+        start = time.perf_counter()
+        recommender.compute_similarity(top_k=neighbor_top_k)
+        results['neighbor_build_s'] = time.perf_counter() - start
+        query_ids = content_ids[rng.integers(0, n_items, n_queries)]
+        results['get_similar_content'] = _latency(
+            recommender.get_similar_content, [(content_id, k) for content_id in query_ids])
+
+    results['recommend_content'] = _latency(
+        recommender.recommend_content, [(profile, k) for profile in profiles[:n_queries]])
+
+    with tempfile.TemporaryDirectory() as model_path:
+        recommender.save(model_path)
+        startup = benchmark_startup(model_path, profiles[0], k)
+    results['startup_modules'] = startup.pop('modules')
+    results['startup'] = startup
+
+    start = time.perf_counter()
+    recommender.recommend_content_batch(profiles[:batch_users], k)
+    results['batch_users_per_s'] = batch_users / (time.perf_counter() - start)
+
+    results['peak_rss_bytes'] = module._peak_rss()
+    return results
+
+
+def benchmark_quantization(module, n_items, n_queries=200, k=10, rescore_factor=4, seed=0):
+    """
+    Compare exact float32 scoring with int8 first-pass scoring plus rescoring
+
+    The quantized recommender is the exact one saved and loaded back
+    memory-mapped, as on a serving node, with int8 codes built from the
+    mapped float features.
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size (fitted in dense mode)
+        n_queries (int): Timed queries per method
+        k (int): Results per query
+        rescore_factor (int): Shortlist size as a multiple of k
+        seed (int): Random seed
+
+    Returns:
+        dict: Feature memory in bytes, latency percentiles per method and
+            mean recall@k of the quantized results against the exact ones
+    """
+    content_df = make_catalog(n_items, seed)
+    profiles = make_profiles(content_df['content_id'].to_numpy(), n_queries, seed=seed)
+
+    exact = module.ContentBasedRecommender()
+    exact.prepare_content_data(content_df)
+
+    with tempfile.TemporaryDirectory() as path:
+        exact.save(path)
+        quantized = module.ContentBasedRecommender.load(path)
+        quantized.quantization = 'int8'
+        quantized.rescore_factor = rescore_factor
+        quantized.build_quantized_features()
+
+        results = {
+            'float32_bytes': exact.content_features.nbytes,
+            'int8_bytes': (quantized.quantized_features.nbytes
+                           + quantized.quantization_scales.nbytes),
+        }
+        recalls = []
+        for name, recommender in [('exact', exact), ('int8', quantized)]:
+            results[name] = _latency(recommender.recommend_content,
+                                     [(profile, k) for profile in profiles])
+        for profile in profiles:
+            expected = {content_id for content_id, _ in exact.recommend_content(profile, k)}
+            found = {content_id for content_id, _ in quantized.recommend_content(profile, k)}
+            if expected:
+                recalls.append(len(expected & found) / len(expected))
+        results['recall_at_k'] = float(np.mean(recalls))
+
+        # Release the memory-mapped files before the directory is removed
+        del quantized
+
+    return results
+
+
+def benchmark_serving(module, n_items, n_requests=2000, concurrency=64, k=10,
+                      max_batch_size=64, max_wait_ms=2.0, seed=0):
+    """
+    Compare one-at-a-time recommend_content with the MicroBatcher front end
+
+    The batched run is closed-loop: concurrency clients each send their
+    next request as soon as the previous one is answered.
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        n_requests (int): Requests per method
+        concurrency (int): Concurrent clients in the batched run
+        k (int): Results per request
+        max_batch_size (int): MicroBatcher batch size limit
+        max_wait_ms (float): MicroBatcher batching window
+        seed (int): Random seed
+
+    Returns:
+        dict: Throughput in requests per second and latency percentiles per
+            method, plus the mean batch size
+    """
+    content_df = make_catalog(n_items, seed)
+    profiles = make_profiles(content_df['content_id'].to_numpy(), n_requests, seed=seed)
+    recommender = module.ContentBasedRecommender()
+    recommender.prepare_content_data(content_df)
+
+    results = {}
+    start = time.perf_counter()
+    results['sequential'] = _latency(recommender.recommend_content,
+                                     [(profile, k) for profile in profiles])
+    results['sequential']['requests_per_s'] = n_requests / (time.perf_counter() - start)
+
+    async def serve():
+        timings = []
+        queue = iter(profiles)
+
+        async def client(batcher):
+            for profile in queue:
+                request_start = time.perf_counter()
+                await batcher.recommend_content(profile, k)
+                timings.append(time.perf_counter() - request_start)
+
+        async with module.MicroBatcher(recommender, max_batch_size=max_batch_size,
+                                       max_wait_ms=max_wait_ms) as batcher:
+            start = time.perf_counter()
+            await asyncio.gather(*[client(batcher) for _ in range(concurrency)])
+            elapsed = time.perf_counter() - start
+            batches = batcher.stats['batches']
+
+        stats = _percentiles(timings)
+        stats['requests_per_s'] = n_requests / elapsed
+        stats['mean_batch_size'] = n_requests / batches
+        return stats
+
+    results['micro_batched'] = asyncio.run(serve())
+    return results
+
+
+def _post_filter(recommender, profile, k, keep):
+    """Over-fetch unfiltered results, doubling until k of them pass keep"""
+    n_fetch = 4 * k
+    while True:
+        results = recommender.recommend_content(profile, n_fetch)
+        kept = [(content_id, score) for content_id, score in results if content_id in keep]
+        if len(kept) >= k or len(results) < n_fetch:
+            return kept[:k]
+        n_fetch *= 2
+
+
+def benchmark_filtered(module, n_items, n_queries=200, k=10, seed=0):
+    """
+    Compare a metadata-filtered query ("Sci-Fi from 2015 on") answered by
+    post-filtering unfiltered results with the inverted metadata index
+
+    Args:
+        module: Loaded template module
+        n_items (int): Catalog size
+        n_queries (int): Queries per method
+        k (int): Results per query
+        seed (int): Random seed
+
+    Returns:
+        dict: Latency percentiles per method, the fraction of the catalog
+            matching the filter, and whether both methods agree
+    """
+    content_df = make_catalog(n_items, seed)
+    profiles = make_profiles(content_df['content_id'].to_numpy(), n_queries, seed=seed)
+    recommender = module.ContentBasedRecommender(sparse=True)
+    recommender.prepare_content_data(content_df)
+
+    filters = {'genres': 'Sci-Fi', 'year': (2015, None)}
+    matches = content_df['genres'].str.contains("'Sci-Fi'") & (content_df['year'] >= 2015)
+    keep = set(content_df.loc[matches, 'content_id'])
+
+    results = {
+        'unfiltered': _latency(recommender.recommend_content,
+                               [(profile, k) for profile in profiles]),
+        'post_filter': _latency(lambda profile: _post_filter(recommender, profile, k, keep),
+                                [(profile,) for profile in profiles]),
+        'metadata_index': _latency(recommender.recommend_content,
+                                   [(profile, k, filters) for profile in profiles]),
+    }
+    results['selectivity'] = float(matches.mean())
+    results['agree'] = all(
+        [content_id for content_id, _ in _post_filter(recommender, profile, k, keep)]
+        == [content_id for content_id, _ in recommender.recommend_content(profile, k, filters)]
+        for profile in profiles[:20])
+    return results
+
+
+def _git_commit():
+    """Commit the benchmark runs against, if inside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(TEMPLATE_PATH)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, **kwargs):
+    """
+    Run benchmark_catalog for every size, each in a fresh process
+
+    Args:
+        sizes (list): Catalog sizes
+        **kwargs: Passed to benchmark_catalog
+
+    Returns:
+        dict: Environment metadata and one result per size
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for n_items in sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(benchmark_catalog, n_items, **kwargs).result())
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'params': kwargs,
+        'runs': runs,
+    }
+
+
+def _suite_metrics(run):
+    """Flatten one suite run into metric name -> value"""
+    metrics = {}
+    for name, value in run.items():
+        if isinstance(value, dict):
+            for key, inner in value.items():
+                metrics[f'{name}.{key}'] = inner
+        elif isinstance(value, (int, float)) and name != 'n_items':
+            metrics[name] = value
+    return metrics
+
+
+def compare_suites(baseline, current):
+    """
+    Print every metric of two suite results side by side
+
+    Args:
+        baseline (dict): Earlier run_suite result
+        current (dict): Later run_suite result
+    """
+    baseline_runs = {run['n_items']: run for run in baseline['runs']}
+    print(f"baseline {baseline.get('commit')} -> current {current.get('commit')}")
+    for run in current['runs']:
+        if run['n_items'] not in baseline_runs:
+            continue
+        before = _suite_metrics(baseline_runs[run['n_items']])
+        for name, value in _suite_metrics(run).items():
+            if before.get(name):
+                print(f"n_items={run['n_items']:>9,} {name:<28} {before[name]:>14.4g} "
+                      f"-> {value:>14.4g} ({value / before[name]:.2f}x)")
+
+
+def _print_suite(suite):
+    """Human-readable summary of run_suite results"""
+    for run in suite['runs']:
+        line = (f"suite n_items={run['n_items']:>9,} fit={run['fit_s']:.2f}s "
+                f"peak_rss={run['peak_rss_bytes'] / 2 ** 20:.0f}MiB "
+                f"recommend p50={run['recommend_content']['p50_ms']:.2f}ms "
+                f"p99={run['recommend_content']['p99_ms']:.2f}ms "
+                f"batch={run['batch_users_per_s']:.0f} users/s")
+        if 'get_similar_content' in run:
+            line += (f" similar p50={run['get_similar_content']['p50_ms']:.3f}ms "
+                     f"p99={run['get_similar_content']['p99_ms']:.3f}ms")
+        if 'startup' in run:
+            line += (f" startup={run['startup']['total_s']:.2f}s "
+                     f"(import {run['startup']['import_s']:.2f}s, "
+                     f"imports {', '.join(run['startup_modules']) or 'numpy only'})")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000],
+                        help='Catalog sizes to benchmark')
+    parser.add_argument('--queries', type=int, default=50,
+                        help='Timed queries per size and method')
+    parser.add_argument('--k', type=int, default=10, help='Results per query')
+    parser.add_argument('--prepare-sizes', type=int, nargs='+', default=[100_000],
+                        help='Catalog sizes for the data preparation benchmark')
+    parser.add_argument('--quantization-sizes', type=int, nargs='+', default=[20_000],
+                        help='Catalog sizes for the int8 recall/latency benchmark')
+    parser.add_argument('--serving-sizes', type=int, nargs='+', default=[20_000],
+                        help='Catalog sizes for the micro-batching serving benchmark')
+    parser.add_argument('--filter-sizes', type=int, nargs='+', default=[100_000],
+                        help='Catalog sizes for the filtered query benchmark')
+    parser.add_argument('--reduction-sizes', type=int, nargs='+', default=[50_000],
+                        help='Catalog sizes for the SVD reduction benchmark')
+    parser.add_argument('--reduction-dims', type=int, nargs='+', default=[64, 128, 256],
+                        help='Reduction dimensions to compare with the full space')
+    parser.add_argument('--shard-sizes', type=int, nargs='+', default=[1_000_000],
+                        help='Catalog sizes for the sharded scatter-gather benchmark')
+    parser.add_argument('--shards', type=int, default=4,
+                        help='Shard worker processes in the sharded benchmark')
+    parser.add_argument('--registry-sizes', type=int, nargs='+', default=[20_000],
+                        help='Per-project catalog sizes for the registry benchmark')
+    parser.add_argument('--projects', type=int, default=20,
+                        help='Projects served by the registry benchmark')
+    parser.add_argument('--resident-projects', type=int, default=5,
+                        help='Registry memory budget in average project sizes')
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help='Concurrent clients in the serving benchmark')
+    parser.add_argument('--suite', action='store_true',
+                        help='Run the end-to-end suite instead of the micro-benchmarks')
+    parser.add_argument('--suite-sizes', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000],
+                        help='Catalog sizes for the end-to-end suite')
+    parser.add_argument('--dense', action='store_true',
+                        help='Fit the suite catalogs in dense mode (default: sparse)')
+    parser.add_argument('--batch-users', type=int, default=1024,
+                        help='Profiles per recommend_content_batch call in the suite')
+    parser.add_argument('--neighbor-max-items', type=int, default=100_000,
+                        help='Largest suite catalog that gets a top-K neighbor index')
+    parser.add_argument('--output', help='Write suite results to this JSON file')
+    parser.add_argument('--compare', help='Suite JSON file of an earlier commit to compare with')
+    args = parser.parse_args()
+
+    if args.suite:
+        suite = run_suite(args.suite_sizes, n_queries=args.queries, k=args.k,
+                          batch_users=args.batch_users, sparse=not args.dense,
+                          neighbor_max_items=args.neighbor_max_items)
+        _print_suite(suite)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(suite, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                compare_suites(json.load(f), suite)
+        return
+
+    module = load_template()
+
+    for n_items in args.prepare_sizes:
+        results = benchmark_preparation(module, n_items)
+        for name, stats in results.items():
+            print(f"prepare n_items={n_items:>9,} {name:<14} best={stats['best_s']:.3f}s")
+
+    for n_items in args.quantization_sizes:
+        results = benchmark_quantization(module, n_items, n_queries=args.queries, k=args.k)
+        print(f"int8 n_items={n_items:>9,} memory {results['float32_bytes'] / 2 ** 20:.1f}MiB "
+              f"-> {results['int8_bytes'] / 2 ** 20:.1f}MiB "
+              f"recall@{args.k}={results['recall_at_k']:.3f}")
+        for name in ('exact', 'int8'):
+            print(f"int8 n_items={n_items:>9,} {name:<14} "
+                  f"p50={results[name]['p50_ms']:.3f}ms p99={results[name]['p99_ms']:.3f}ms")
+
+    for n_items in args.serving_sizes:
+        results = benchmark_serving(module, n_items, concurrency=args.concurrency, k=args.k)
+        for name, stats in results.items():
+            print(f"serve n_items={n_items:>9,} {name:<14} "
+                  f"{stats['requests_per_s']:.0f} req/s "
+                  f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms")
+
+    for n_items in args.filter_sizes:
+        results = benchmark_filtered(module, n_items, n_queries=args.queries, k=args.k)
+        print(f"filter n_items={n_items:>9,} selectivity={results['selectivity']:.3f} "
+              f"agree={results['agree']}")
+        for name in ('unfiltered', 'post_filter', 'metadata_index'):
+            print(f"filter n_items={n_items:>9,} {name:<14} "
+                  f"p50={results[name]['p50_ms']:.3f}ms p99={results[name]['p99_ms']:.3f}ms")
+
+    for n_items in args.reduction_sizes:
+        results = benchmark_reduction(module, n_items, args.reduction_dims,
+                                      n_queries=args.queries, k=args.k)
+        print(f"reduce n_items={n_items:>9,} full "
+              f"sparse={results['full']['feature_bytes'] / 2 ** 20:.1f}MiB "
+              f"dense={results['full']['dense_feature_bytes'] / 2 ** 20:.1f}MiB "
+              f"p50={results['full']['p50_ms']:.3f}ms")
+        for name, stats in results.items():
+            if name != 'full':
+                print(f"reduce n_items={n_items:>9,} {name:<8} "
+                      f"{stats['feature_bytes'] / 2 ** 20:.1f}MiB "
+                      f"fit={stats['fit_s']:.1f}s p50={stats['p50_ms']:.3f}ms "
+                      f"recall@{args.k}={stats['recall_at_k']:.3f} "
+                      f"recall@{10 * args.k}={stats['recall_at_10k']:.3f}")
+
+    for n_items in args.shard_sizes:
+        results = benchmark_sharded(module, n_items, args.shards, n_queries=args.queries,
+                                    k=args.k)
+        print(f"shard n_items={n_items:>9,} shards={args.shards} agree={results['agree']}")
+        for name in ('single', 'sharded'):
+            stats = results[name]
+            print(f"shard n_items={n_items:>9,} {name:<14} "
+                  f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms "
+                  f"batch={stats['batch_users_per_s']:.0f} users/s")
+
+    for n_items in args.registry_sizes:
+        results = benchmark_registry(module, n_items, args.projects, args.resident_projects,
+                                     k=args.k)
+        stats = results['stats']
+        print(f"registry n_items={n_items:>9,} projects={args.projects} "
+              f"hit_rate={results['hit_rate']:.3f} evictions={stats['evictions']} "
+              f"fit={results['fit_mean_s']:.2f}s load_p50={results['load_p50_ms']:.1f}ms "
+              f"load_p99={results['load_p99_ms']:.1f}ms "
+              f"request_p50={results['p50_ms']:.3f}ms request_p99={results['p99_ms']:.3f}ms")
+
+    for n_items in args.sizes:
+        results = benchmark_top_k(module, n_items, n_queries=args.queries, k=args.k)
+        for name, stats in results.items():
+            print(f"top-k n_items={n_items:>9,} {name:<14} "
+                  f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,334 +3,4072 @@ Content-Based Filtering Template for Media & Entertainment
 This template implements content-based recommendations for movies, shows, and music
 """
 
+import asyncio
+import copy
+import heapq
+import importlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener, wait
+
 import numpy as np
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MultiLabelBinarizer
 import warnings
 
 warnings.filterwarnings('ignore')
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
-class ContentBasedRecommender:
+
+class _LazyModule:
     """
-    Content-Based Recommendation System for Media & Entertainment
-    Supports movies, TV shows, music, and other content types
+    Module proxy that imports the module on first attribute access
+
+    Serving processes that only load a saved dense model and score it never
+    touch pandas or SciPy, so they skip importing them. scikit-learn is
+    imported inside the fitting methods that use it.
     """
 
-    def __init__(self, content_type='movies'):
-        """
-        Initialize the recommender
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule('pandas')
+sp = _LazyModule('scipy.sparse')
+
+
+def _issparse(array):
+    """sp.issparse without importing SciPy: nothing is sparse before it is loaded"""
+    return 'scipy.sparse' in sys.modules and sp.issparse(array)
+
+
+def _normalize(matrix):
+    """
+    L2-normalize the rows of a matrix
+
+    Dense matrices are normalized with NumPy alone, the same way as
+    sklearn.preprocessing.normalize; sparse ones are passed to it.
+
+    Args:
+        matrix: Dense array or sparse matrix
+
+    Returns:
+        Matrix of the same kind with unit-length (or all-zero) rows
+    """
+    if _issparse(matrix):
+        from sklearn.preprocessing import normalize
+        return normalize(matrix)
+
+    matrix = np.asarray(matrix)
+    if not np.issubdtype(matrix.dtype, np.floating):
+        matrix = matrix.astype(np.float64)
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+    # Rows of (near) zero length are left as they are
+    norms[norms < 10 * np.finfo(norms.dtype).eps] = 1.0
+    return matrix / norms[:, np.newaxis]
+
+
+def _dot(features, vectors, block_size=65536):
+    """
+    Dense result of features @ vectors
+
+    float16 and int8 storage is upcast to float32 one row block at a time,
+    since NumPy has no fast half-precision or integer-by-float matrix
+    product and upcasting the whole matrix would defeat the point of the
+    compact storage. Blocks are kept cache-sized (about 1 MiB of float32
+    for a single vector, 4 MiB for a matrix of vectors), which makes the
+    upcast product about as fast as a float32 one.
+
+    Args:
+        features: Feature matrix (dense or CSR)
+        vectors: 1D vector or 2D matrix with features.shape[1] rows
+        block_size (int): Upper bound on rows upcast per block for
+            float16/int8 storage
+
+    Returns:
+        np.ndarray: Scores with features.shape[0] rows
+    """
+    if features.dtype not in (np.float16, np.int8):
+        result = features @ vectors
+        return result.toarray() if _issparse(result) else np.asarray(result)
+
+    block_bytes = 1 << 20 if vectors.ndim == 1 else 1 << 22
+    block_size = max(1, min(block_size, block_bytes // (4 * max(features.shape[1], 1))))
+    result = np.empty((features.shape[0],) + vectors.shape[1:], dtype=np.float32)
+    for start in range(0, features.shape[0], block_size):
+        end = min(start + block_size, features.shape[0])
+        result[start:end] = features[start:end].astype(np.float32) @ vectors
+    return result
+
+
+def _quantize_int8(features, block_size=65536):
+    """
+    Symmetric per-row int8 quantization of a dense feature matrix
+
+    Every row is scaled so its largest absolute value maps to 127. Rows are
+    read one block at a time, so a memory-mapped matrix is never loaded
+    whole.
+
+    Args:
+        features (np.ndarray): Dense feature matrix
+        block_size (int): Rows quantized per block
+
+    Returns:
+        tuple: (codes, scales) with features ~= codes * scales[:, None]
+    """
+    codes = np.empty(features.shape, dtype=np.int8)
+    scales = np.empty(features.shape[0], dtype=np.float32)
+    for start in range(0, features.shape[0], block_size):
+        end = min(start + block_size, features.shape[0])
+        rows = np.asarray(features[start:end], dtype=np.float32)
+        block_scales = np.abs(rows).max(axis=1) / 127
+        block_scales[block_scales == 0] = 1.0
+        codes[start:end] = np.rint(rows / block_scales[:, None])
+        scales[start:end] = block_scales
+    return codes, scales
+
+
+def _top_k(scores, k, exclude=None):
+    """
+    Select the k highest scores of a 1D score vector without a full sort
+
+    Args:
+        scores (np.ndarray): Score per item. Masked in place when exclude is
+            given, so pass a scratch array rather than a shared one.
+        k (int): Number of entries to return
+        exclude (array-like): Item indices that must not be returned
+
+    Returns:
+        tuple: (indices, values) sorted by descending score
+    """
+    if exclude is not None and len(exclude):
+        scores[exclude] = -np.inf
+
+    n_items = scores.shape[0]
+    k = min(k, n_items)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), scores[:0]
+
+    if k < n_items:
+        candidates = np.argpartition(scores, n_items - k)[n_items - k:]
+    else:
+        candidates = np.arange(n_items)
+
+    candidate_scores = scores[candidates]
+    order = np.argsort(-candidate_scores, kind='stable')
+
+    return candidates[order], candidate_scores[order]
+
+
+def _top_k_rows(scores, k):
+    """
+    Select the k highest scores in every row without a full sort
+
+    Args:
+        scores (np.ndarray): 2D score matrix
+        k (int): Number of entries to keep per row (k <= scores.shape[1])
+
+    Returns:
+        tuple: (indices, values), both of shape (n_rows, k) sorted by
+            descending score
+    """
+    n_columns = scores.shape[1]
+    if k < n_columns:
+        candidates = np.argpartition(scores, n_columns - k, axis=1)[:, n_columns - k:]
+    else:
+        candidates = np.tile(np.arange(n_columns), (scores.shape[0], 1))
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+
+    return (np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1))
+
+
+def _mmr(relevance, similarity, k, diversity_lambda):
+    """
+    Greedy maximal marginal relevance selection
+
+    Each step picks the candidate maximizing
+    lambda * relevance - (1 - lambda) * max similarity to the picks so far.
+    The max similarity of every candidate is updated with the new pick's
+    similarity row, so a step is O(pool) instead of O(picks x pool).
+
+    Args:
+        relevance (np.ndarray): Relevance score per candidate
+        similarity (np.ndarray): Pairwise candidate similarity matrix
+        k (int): Number of candidates to pick
+        diversity_lambda (float): 1.0 ranks by relevance only, lower
+            values trade relevance for diversity
+
+    Returns:
+        np.ndarray: Positions of the picked candidates in pick order
+    """
+    k = min(k, len(relevance))
+    picked = np.empty(k, dtype=np.intp)
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+
+    for step in range(k):
+        marginal = (diversity_lambda * relevance
+                    - (1 - diversity_lambda) * max_similarity)
+        marginal[~available] = -np.inf
+        pick = picked[step] = np.argmax(marginal)
+        available[pick] = False
+        np.maximum(max_similarity, similarity[pick], out=max_similarity)
+
+    return picked
+
+
+def _category_cap(labels, k, max_per_category):
+    """
+    Greedy selection allowing at most max_per_category picks per label
+
+    Candidates are taken in relevance order. A candidate is skipped while
+    any of its labels is at the cap; skipped candidates fill the remaining
+    slots if fewer than k pass.
+
+    Args:
+        labels (sp.csr_matrix): Candidate x label membership, in relevance
+            order
+        k (int): Number of candidates to pick
+        max_per_category (int): Picks allowed per label
+
+    Returns:
+        np.ndarray: Positions of the picked candidates in pick order
+    """
+    counts = np.zeros(labels.shape[1], dtype=np.intp)
+    picked, skipped = [], []
+
+    for position in range(labels.shape[0]):
+        columns = labels.indices[labels.indptr[position]:labels.indptr[position + 1]]
+        if (counts[columns] < max_per_category).all():
+            picked.append(position)
+            counts[columns] += 1
+            if len(picked) == k:
+                break
+        else:
+            skipped.append(position)
+
+    picked.extend(skipped[:k - len(picked)])
+    return np.asarray(picked, dtype=np.intp)
+
+
+def _preference_vector(state):
+    """
+    User vector from liked/disliked feature sums and counts
+
+    Args:
+        state (dict): liked_sum, n_liked (> 0), disliked_sum, n_disliked
+
+    Returns:
+        np.ndarray: Average liked vector minus half the average disliked
+            vector
+    """
+    user_vector = state['liked_sum'] / state['n_liked']
+
+    # Subtract disliked content if available
+    if state['n_disliked']:
+        user_vector -= 0.5 * state['disliked_sum'] / state['n_disliked']
+
+    return user_vector
+
+
+def _neighbor_block(features, rows, k, removed_indices):
+    """
+    Exact top-k neighbors of the given item rows
+
+    Args:
+        features: L2-normalized feature matrix (dense or CSR)
+        rows (np.ndarray): Item indices to compute neighbors for
+        k (int): Neighbors per item
+        removed_indices (np.ndarray): Tombstoned items that never appear
+
+    Returns:
+        tuple: (indices, scores) of shape (len(rows), k)
+    """
+    block = features[rows]
+    if not _issparse(block):
+        block = block.astype(np.float32)
+    block_scores = _dot(features, block.T).T.astype(np.float32, copy=False)
+
+    # An item is never its own neighbor, and removed items never appear
+    block_scores[np.arange(len(rows)), rows] = -np.inf
+    block_scores[:, removed_indices] = -np.inf
+
+    return _top_k_rows(block_scores, k)
+
+
+# Per-process state of neighbor build workers, set by _init_neighbor_worker
+_NEIGHBOR_WORKER = {}
+
+
+def _share_array(array, segments):
+    """Copy an array into a new shared memory segment and describe it"""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    segments.append(segment)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment.name, array.shape, array.dtype.str
+
+
+def _init_neighbor_worker(feature_specs, feature_shape, removed_indices):
+    """Attach a worker process to the shared feature matrix (no copy)"""
+    arrays = []
+    for name, shape, dtype in feature_specs:
+        segment = shared_memory.SharedMemory(name=name)
+        _NEIGHBOR_WORKER.setdefault('segments', []).append(segment)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=segment.buf))
+
+    if len(arrays) == 3:
+        features = sp.csr_matrix(tuple(arrays), shape=feature_shape, copy=False)
+    else:
+        features = arrays[0]
+
+    _NEIGHBOR_WORKER['features'] = features
+    _NEIGHBOR_WORKER['removed_indices'] = removed_indices
+
+
+def _neighbor_block_task(start, end, k):
+    """Top-k neighbors of one row block, computed in a worker process"""
+    indices, scores = _neighbor_block(_NEIGHBOR_WORKER['features'],
+                                      np.arange(start, end), k,
+                                      _NEIGHBOR_WORKER['removed_indices'])
+    return start, indices, scores
+
+
+def _parse_label_column(column, delimiter=None):
+    """
+    Parse a genres/tags column into (row, label) pairs without eval
+
+    Entries may be lists, list literals such as "['Sci-Fi', 'Action']",
+    delimited strings (when delimiter is given) or single labels. Parsing
+    uses column-wide pandas string operations instead of a per-row loop.
+
+    Args:
+        column (pd.Series): Raw categorical column
+        delimiter (str): Separator for plain string entries, e.g. '|'
+
+    Returns:
+        pd.Series: One label per entry, indexed by row position
+    """
+    values = column.reset_index(drop=True).explode()
+    values = values[values.notna()]
+
+    if not pd.api.types.is_string_dtype(values.dtype):
+        return values
+
+    # Non-string labels (e.g. numeric IDs) come out of .str as NaN
+    text = values.str.strip()
+    pieces = [values[text.isna()]]
+
+    # List literals: quoted tokens, or bare comma-separated values
+    is_literal = (text.str.startswith('[', na=False) &
+                  text.str.endswith(']', na=False))
+    inner = text[is_literal].str.slice(1, -1)
+    has_quotes = inner.str.contains('[\'"]', regex=True)
+
+    quoted = inner[has_quotes].str.extractall(r"'([^']*)'|\"([^\"]*)\"")
+    if len(quoted):
+        pieces.append(quoted[0].fillna(quoted[1]).droplevel('match'))
+    pieces.append(inner[~has_quotes].str.split(',').explode().str.strip())
+
+    # Plain strings are a single label unless a delimiter is configured
+    plain = text[text.notna() & ~is_literal]
+    if delimiter is not None:
+        plain = plain.str.split(delimiter, regex=False).explode().str.strip()
+    pieces.append(plain)
+
+    labels = pd.concat(pieces).sort_index(kind='stable')
+    return labels[labels.notna() & (labels != '')]
+
+
+def _peak_rss():
+    """Peak resident set size of the process in bytes (None if unknown)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _nbytes(array):
+    """Memory held by a dense or CSR array"""
+    if _issparse(array):
+        return array.data.nbytes + array.indices.nbytes + array.indptr.nbytes
+    return array.nbytes
+
+
+def _truncate_npy(path, length, block_size=1 << 24):
+    """Shrink a 1D .npy file to its first length entries without loading it"""
+    source = np.load(path, mmap_mode='r')
+    tmp_path = f'{path}.tmp'
+    target = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=source.dtype,
+                                       shape=(length,))
+    for start in range(0, length, block_size):
+        end = min(start + block_size, length)
+        target[start:end] = source[start:end]
+    target.flush()
+    del source, target
+    os.replace(tmp_path, path)
+
+
+def _is_mapped_from(array, path):
+    """Whether an array is a memory-mapped view of the file at path"""
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return (array.filename is not None and os.path.exists(path)
+                    and os.path.samefile(array.filename, path))
+        array = getattr(array, 'base', None)
+    return False
+
+
+def _id_array(content_ids):
+    """Content IDs as a NumPy array; object arrays of one type are converted"""
+    if not hasattr(content_ids, '__array__'):
+        # Read lists as objects first, NumPy would turn [1, 'a'] into strings
+        content_ids = np.array(list(content_ids), dtype=object)
+    content_ids = np.asarray(content_ids)
+    if content_ids.dtype == object and content_ids.size:
+        # pandas string columns and lists of str arrive as object arrays
+        types = set(map(type, content_ids.ravel()))
+        if all(issubclass(t, str) for t in types):
+            content_ids = content_ids.astype(str)
+        elif not any(issubclass(t, (bool, np.bool_)) for t in types):
+            if all(issubclass(t, (int, np.integer)) for t in types):
+                content_ids = content_ids.astype(np.int64)
+            elif all(issubclass(t, (int, float, np.integer, np.floating)) for t in types):
+                content_ids = content_ids.astype(np.float64)
+    return content_ids
+
+
+def _comparable_ids(a, b):
+    """Whether two ID arrays can be searched against each other"""
+    if a.dtype.kind not in 'biufU' or b.dtype.kind not in 'biufU':
+        return False
+    return (a.dtype.kind == 'U') == (b.dtype.kind == 'U')
+
+
+class CategoricalEncoder:
+    """
+    Sparse multi-label encoder for several categorical fields
+
+    Every field (genres, tags, ...) has its own namespace: a column range
+    holding the field's label vocabulary in sorted order, followed by
+    hash_buckets columns that labels outside the vocabulary are hashed
+    into (they are dropped when hash_buckets is 0). The same label in two
+    fields gets a column in each. max_categories caps every field's
+    vocabulary at its most frequent labels, so a long tag tail costs at
+    most max_categories + hash_buckets columns.
+    """
 
+    def __init__(self, max_categories=None, hash_buckets=0):
+        """
         Args:
-            content_type (str): 'movies', 'music', 'shows', or 'general'
+            max_categories (int): Vocabulary size limit per field (default:
+                every label seen at fit time)
+            hash_buckets (int): Hashed columns per field for labels outside
+                the vocabulary
         """
-        self.content_type = content_type
-        self.content_features = None
-        self.similarity_matrix = None
-        self.content_mapping = {}
-        self.reverse_content_mapping = {}
-        self.tfidf_vectorizer = None
-        self.mlb = None
+        self.max_categories = max_categories
+        self.hash_buckets = hash_buckets
+        self.vocabularies = {}
+        self.offsets = {}
+        self.n_features = 0
 
-    def prepare_content_data(self, content_df):
+    def fit(self, label_columns):
         """
-        Prepare content data for content-based filtering
+        Learn the vocabulary of every field
 
         Args:
-            content_df (pd.DataFrame): Content metadata with columns:
-                - content_id: Unique identifier
-                - title: Content title
-                - description: Content description/plot
-                - genres: List of genres (optional)
-                - tags: List of tags (optional)
-                - other metadata columns based on content type
+            label_columns (dict): Field name -> pd.Series of labels indexed
+                by row position, as returned by _parse_label_column
 
         Returns:
-            pd.DataFrame: Processed content features
+            CategoricalEncoder: self
         """
-        # Create content mapping
-        self.content_mapping = {content_id: idx for idx, content_id in
-                               enumerate(content_df['content_id'].unique())}
-        self.reverse_content_mapping = {idx: content_id for content_id, idx in
-                                       self.content_mapping.items()}
+        return self.fit_counts({field: labels.value_counts()
+                                for field, labels in label_columns.items()})
 
-        # Map content IDs to indices
-        content_df['content_idx'] = content_df['content_id'].map(
-            self.content_mapping)
+    def fit_counts(self, label_counts):
+        """
+        Learn the vocabulary of every field from label frequencies
 
-        # Sort by content_idx to maintain consistency
-        content_df = content_df.sort_values('content_idx').reset_index(drop=True)
+        Args:
+            label_counts (dict): Field name -> pd.Series of counts indexed
+                by label; fields are laid out in this order
 
-        # Process text features
-        text_features = self._process_text_features(content_df)
+        Returns:
+            CategoricalEncoder: self
+        """
+        self.vocabularies = {}
+        self.offsets = {}
+        self.n_features = 0
 
-        # Process categorical features
-        categorical_features = self._process_categorical_features(content_df)
+        for field, counts in label_counts.items():
+            if self.max_categories is not None and len(counts) > self.max_categories:
+                # Most frequent labels, ties broken by label so the
+                # vocabulary does not depend on row order
+                counts = counts.sort_index().sort_values(ascending=False, kind='stable')
+                counts = counts.iloc[:self.max_categories]
 
-        # Process numerical features
-        numerical_features = self._process_numerical_features(content_df)
+            self.vocabularies[field] = pd.Index(counts.index, dtype=object).sort_values()
+            self.offsets[field] = self.n_features
+            self.n_features += len(self.vocabularies[field]) + self.hash_buckets
 
-        # Combine all features
-        self.content_features = self._combine_features(
-            text_features, categorical_features, numerical_features)
+        return self
 
-        return self.content_features
+    def columns(self, field, labels):
+        """
+        Column of every label of one field
 
-    def _process_text_features(self, content_df):
-        """Process text-based features using TF-IDF"""
-        # Combine text fields
-        text_columns = ['title', 'description']
-        available_text_columns = [col for col in text_columns if col in content_df.columns]
+        Args:
+            field (str): Field name
+            labels (array-like): Labels of that field
 
-        if not available_text_columns:
-            return None
+        Returns:
+            np.ndarray: Column index per label, -1 for dropped labels
+        """
+        labels = np.asarray(labels, dtype=object)
+        vocabulary = self.vocabularies.get(field)
+        if vocabulary is None:
+            return np.full(len(labels), -1, dtype=np.int64)
 
-        # Create combined text field
-        content_df['combined_text'] = content_df[available_text_columns].fillna('').apply(
-            lambda x: ' '.join(x), axis=1)
+        columns = vocabulary.get_indexer(labels).astype(np.int64)
+        unknown = columns < 0
+        if self.hash_buckets and unknown.any():
+            columns[unknown] = len(vocabulary) + (
+                pd.util.hash_array(labels[unknown]) % self.hash_buckets).astype(np.int64)
 
-        # Initialize TF-IDF vectorizer
-        self.tfidf_vectorizer = TfidfVectorizer(
-            max_features=5000,
-            stop_words='english',
-            ngram_range=(1, 2),
-            min_df=2,
-            max_df=0.8
-        )
+        columns[columns >= 0] += self.offsets[field]
+        return columns
 
-        # Fit and transform text features
-        text_features = self.tfidf_vectorizer.fit_transform(
-            content_df['combined_text'])
+    def transform(self, label_columns, n_rows):
+        """
+        Encode the labels of every field into one sparse block
 
-        return text_features.toarray()
+        Args:
+            label_columns (dict): Field name -> pd.Series of labels indexed
+                by row position (missing fields encode as empty)
+            n_rows (int): Number of rows
 
-    def _process_categorical_features(self, content_df):
-        """Process categorical features like genres, tags"""
-        categorical_columns = ['genres', 'tags']
-        available_categorical = [col for col in categorical_columns if col in content_df.columns]
+        Returns:
+            scipy.sparse.csr_matrix: n_rows x n_features 0/1 matrix
+        """
+        rows, columns = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for field, labels in label_columns.items():
+            field_columns = self.columns(field, labels.to_numpy())
+            keep = field_columns >= 0
+            rows.append(labels.index.to_numpy()[keep])
+            columns.append(field_columns[keep])
 
-        if not available_categorical:
-            return None
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        matrix = sp.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                               shape=(n_rows, self.n_features))
 
-        # Process first available categorical column
-        cat_col = available_categorical[0]
+        # Repeated labels (or labels sharing a bucket) still encode as 1
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
 
-        # Handle different formats of categorical data
-        if content_df[cat_col].dtype == 'object':
-            # Handle string representation of lists
-            try:
-                content_df[cat_col] = content_df[cat_col].apply(
-                    lambda x: eval(x) if isinstance(x, str) else x)
-            except:
-                content_df[cat_col] = content_df[cat_col].fillna('').apply(
-                    lambda x: [x] if x else [])
 
-        # Ensure all entries are lists
-        content_df[cat_col] = content_df[cat_col].apply(
-            lambda x: x if isinstance(x, list) else [x])
+class MetadataIndex:
+    """
+    Inverted index over item metadata for filtered recommendations
 
-        # Multi-label binarization
-        self.mlb = MultiLabelBinarizer()
-        categorical_features = self.mlb.fit_transform(content_df[cat_col])
+    Label fields (genres, tags, region, ...) keep a posting list of rows
+    per label as the columns of a boolean CSC matrix. Numerical fields keep
+    their rows sorted by value, so a range is one searchsorted slice. A
+    filter expression is turned into a row bitmap without touching the
+    feature matrix, and only the matching rows are scored.
 
-        return categorical_features
+    Filters map a field to a condition and all conditions must hold:
+        {'genres': ['Sci-Fi', 'Thriller'],  # any of these labels
+         'region': 'US',                    # a single label
+         'year': (2015, None),              # inclusive range, open end
+         'runtime': [90, 120],              # a list works as a range too
+         'rating': 8.0}                     # exact value
+    """
 
-    def _process_numerical_features(self, content_df):
-        """Process numerical features like ratings, year, duration"""
-        numerical_columns = {
-            'movies': ['year', 'duration', 'rating', 'vote_count'],
-            'music': ['year', 'duration', 'tempo', 'energy', 'danceability'],
-            'shows': ['year', 'seasons', 'episodes', 'rating'],
-            'general': ['year', 'rating', 'popularity']
-        }
+    def __init__(self):
+        self.labels = {}
+        self.numerical = {}
+        self.n_rows = 0
+        # Row-major copies of the label postings, built on first use
+        self._row_labels = {}
 
-        available_numerical = [col for col in numerical_columns.get(
-            self.content_type, []) if col in content_df.columns]
+    def add(self, label_columns, numerical_columns, n_rows):
+        """
+        Append rows to the index
 
-        if not available_numerical:
-            return None
+        Args:
+            label_columns (dict): Field name -> pd.Series of labels indexed
+                by row position within the new rows
+            numerical_columns (dict): Field name -> np.ndarray with one
+                value per new row
+            n_rows (int): Number of new rows
+        """
+        start = self.n_rows
+        self._row_labels = {}
+        for field in dict.fromkeys([*self.labels, *label_columns]):
+            labels = label_columns.get(field, pd.Series([], dtype=object))
+            vocabulary, postings = self.labels.get(
+                field, (pd.Index([], dtype=object), sp.csc_matrix((start, 0), dtype=bool)))
 
-        numerical_features = content_df[available_numerical].fillna(0).values
+            # Labels first seen now get new columns at the end
+            vocabulary = vocabulary.append(
+                pd.Index(labels.unique(), dtype=object).difference(vocabulary, sort=False))
+            new_postings = sp.csc_matrix(
+                (np.ones(len(labels), dtype=bool),
+                 (labels.index.to_numpy(), vocabulary.get_indexer(labels.to_numpy()))),
+                shape=(n_rows, len(vocabulary)))
+            postings.resize((start, len(vocabulary)))
+            self.labels[field] = (vocabulary, sp.vstack([postings, new_postings], format='csc'))
 
-        # Normalize numerical features
-        numerical_features = (numerical_features - numerical_features.mean()) / (
-            numerical_features.std() + 1e-8)
+        for field in dict.fromkeys([*self.numerical, *numerical_columns]):
+            new_values = np.asarray(numerical_columns.get(field, np.full(n_rows, np.nan)),
+                                    dtype=np.float64)
+            values, order, sorted_values = self.numerical.get(
+                field, (np.empty(0), np.empty(0, dtype=np.intp), np.empty(0)))
 
-        return numerical_features
+            # Merge the new rows into the sorted order
+            new_order = np.argsort(new_values, kind='stable')
+            positions = np.searchsorted(sorted_values, new_values[new_order], side='right')
+            self.numerical[field] = (
+                np.concatenate([values, new_values]),
+                np.insert(order, positions, start + new_order),
+                np.insert(sorted_values, positions, new_values[new_order]))
 
-    def _combine_features(self, text_features, categorical_features, numerical_features):
-        """Combine different feature types into a single feature matrix"""
-        features_list = []
+        self.n_rows += n_rows
 
-        if text_features is not None:
-            features_list.append(text_features)
+    @classmethod
+    def from_arrays(cls, fields, arrays, n_rows):
+        """
+        Rebuild an index from the arrays written by save()
 
-        if categorical_features is not None:
-            features_list.append(categorical_features)
+        Args:
+            fields (dict): Field name -> 'labels' or 'numerical'
+            arrays (dict): Saved arrays, keyed 'metadata.<field>.<name>'
+            n_rows (int): Number of rows
 
-        if numerical_features is not None:
-            features_list.append(numerical_features)
+        Returns:
+            MetadataIndex: The index
+        """
+        index = cls()
+        index.n_rows = n_rows
+        for field, kind in fields.items():
+            if kind == 'labels':
+                vocabulary = pd.Index(arrays[f'metadata.{field}.vocabulary'].tolist(),
+                                      dtype=object)
+                indices = arrays[f'metadata.{field}.indices']
+                index.labels[field] = (vocabulary, sp.csc_matrix(
+                    (np.ones(len(indices), dtype=bool), indices,
+                     arrays[f'metadata.{field}.indptr']),
+                    shape=(n_rows, len(vocabulary))))
+            else:
+                index.numerical[field] = tuple(
+                    arrays[f'metadata.{field}.{name}']
+                    for name in ('values', 'order', 'sorted_values'))
+        return index
 
-        if not features_list:
-            raise ValueError("No features available for content-based filtering")
+    def take(self, rows):
+        """
+        Index of a subset of rows, renumbered from 0 (used by compact)
 
-        # Concatenate all features
-        combined_features = np.hstack(features_list)
+        Args:
+            rows (np.ndarray): Sorted rows to keep
 
-        return combined_features
+        Returns:
+            MetadataIndex: New index over the kept rows
+        """
+        index = MetadataIndex()
+        index.n_rows = len(rows)
+        for field, (vocabulary, postings) in self.labels.items():
+            index.labels[field] = (vocabulary, postings[rows].tocsc())
+        for field, (values, _, _) in self.numerical.items():
+            kept = values[rows]
+            order = np.argsort(kept, kind='stable')
+            index.numerical[field] = (kept, order, kept[order])
+        return index
 
-    def compute_similarity(self):
+    def row_labels(self, field, rows):
         """
-        Compute content similarity matrix
+        Labels of the given rows
+
+        Args:
+            field (str): Indexed label field
+            rows (np.ndarray): Row indices
+
+        Returns:
+            sp.csr_matrix: Row x label membership, one row per given row
         """
-        self.similarity_matrix = cosine_similarity(self.content_features)
-        return self.similarity_matrix
+        if field not in self.labels:
+            raise ValueError(f"Field is not indexed for filtering: {field}")
+        if field not in self._row_labels:
+            self._row_labels[field] = self.labels[field][1].tocsr()
+        return self._row_labels[field][rows]
 
-    def get_similar_content(self, content_id, n_similar=10):
+    def mask(self, filters):
         """
-        Get similar content based on content features
+        Rows matching every condition of a filter expression
 
         Args:
-            content_id: Original content ID
-            n_similar (int): Number of similar items to return
+            filters (dict): Field name -> condition (see the class docstring)
 
         Returns:
-            list: List of (content_id, similarity_score) tuples
+            np.ndarray: Boolean row mask
         """
-        if content_id not in self.content_mapping:
-            return []
+        mask = np.ones(self.n_rows, dtype=bool)
+        for field, condition in filters.items():
+            if field in self.numerical:
+                _, order, sorted_values = self.numerical[field]
+                if isinstance(condition, (tuple, list)):
+                    # Lists too, as filters decoded from JSON have no tuples
+                    if len(condition) != 2:
+                        raise ValueError(f"Range of {field} must be (low, high), "
+                                         f"got {condition!r}")
+                    low, high = condition
+                elif isinstance(condition, str) or np.iterable(condition):
+                    raise ValueError(f"Condition on {field} must be a number or a "
+                                     f"(low, high) range, got {condition!r}")
+                else:
+                    low, high = condition, condition
+                # NaN sorts last and never matches, even an open range
+                low = -np.inf if low is None else low
+                high = np.inf if high is None else high
+                rows = order[np.searchsorted(sorted_values, low, side='left'):
+                             np.searchsorted(sorted_values, high, side='right')]
+            elif field in self.labels:
+                vocabulary, postings = self.labels[field]
+                if isinstance(condition, str) or not np.iterable(condition):
+                    condition = [condition]
+                columns = vocabulary.get_indexer(pd.Index(list(condition), dtype=object))
+                rows = [postings.indices[postings.indptr[column]:postings.indptr[column + 1]]
+                        for column in columns[columns >= 0]]
+                rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+            else:
+                raise ValueError(f"Field is not indexed for filtering: {field}")
 
-        content_idx = self.content_mapping[content_id]
-        similarities = self.similarity_matrix[content_idx]
+            field_mask = np.zeros(self.n_rows, dtype=bool)
+            field_mask[rows] = True
+            mask &= field_mask
 
-        # Get top similar content (excluding itself)
-        similar_indices = np.argsort(similarities)[::-1][1:n_similar+1]
+        return mask
 
-        similar_content = []
-        for idx in similar_indices:
-            original_id = self.reverse_content_mapping[idx]
-            similarity_score = similarities[idx]
-            similar_content.append((original_id, similarity_score))
 
-        return similar_content
+class ContentIdIndex:
+    """
+    Array-backed mapping between content IDs and internal row indices
 
-    def recommend_content(self, user_profile, n_recommendations=10):
+    ids holds the content ID of every feature row, tombstoned rows
+    included. order lists the live rows sorted by ID and sorted_ids their
+    IDs, so a whole array of IDs is translated with one searchsorted call.
+    Integer IDs cost 24 bytes per item; string IDs 8 bytes per character
+    of the longest ID plus 8.
+    """
+
+    ARRAYS = ('ids', 'order', 'sorted_ids')
+
+    def __init__(self, content_ids=(), removed_indices=()):
         """
-        Recommend content based on user profile
+        Build the index from the content ID of every row
 
         Args:
-            user_profile (dict): User profile with:
-                - liked_content: List of content IDs user liked
-                - disliked_content: List of content IDs user disliked
-                - preferred_genres: List of preferred genres (optional)
-            n_recommendations (int): Number of recommendations to generate
-
-        Returns:
-            list: List of (content_id, recommendation_score) tuples
+            content_ids (array-like): Content ID of each row, all strings or
+                all numbers
+            removed_indices (array-like): Tombstoned rows, not looked up
         """
-        if not user_profile.get('liked_content'):
-            return []
+        ids = _id_array(content_ids)
+        if not len(ids):
+            ids = ids.astype(np.int64)
+        if ids.dtype.kind not in 'biufU':
+            raise ValueError("Content IDs must be all strings or all numbers")
 
-        # Calculate user preference vector
-        user_vector = self._calculate_user_vector(user_profile)
+        live = np.setdiff1d(np.arange(len(ids)), removed_indices)
+        self.ids = ids
+        self.order = live[np.argsort(ids[live], kind='stable')]
+        self.sorted_ids = ids[self.order]
 
-        # Calculate similarity between user vector and all content
-        content_scores = cosine_similarity([user_vector], self.content_features)[0]
+        if (self.sorted_ids[1:] == self.sorted_ids[:-1]).any():
+            raise ValueError("Duplicate content IDs")
 
-        # Exclude content user has already seen
-        seen_content = set(user_profile.get('liked_content', []) +
-                          user_profile.get('disliked_content', []))
-        seen_indices = [self.content_mapping[content_id] for content_id in
-                        seen_content if content_id in self.content_mapping]
+    @classmethod
+    def from_arrays(cls, ids, order, sorted_ids):
+        """Wrap arrays written by save() without re-sorting them"""
+        index = cls.__new__(cls)
+        index.ids = ids
+        index.order = order
+        index.sorted_ids = sorted_ids
+        return index
 
-        # Set scores of seen content to -1
-        content_scores[seen_indices] = -1
+    def __len__(self):
+        return len(self.order)
 
-        # Get top recommendations
-        top_indices = np.argsort(content_scores)[::-1][:n_recommendations]
+    def __contains__(self, content_id):
+        return self.ids_to_idx([content_id])[0] >= 0
 
-        recommendations = []
-        for idx in top_indices:
-            if content_scores[idx] > 0:  # Only include positive scores
-                original_id = self.reverse_content_mapping[idx]
-                recommendations.append((original_id, content_scores[idx]))
+    def ids_to_idx(self, content_ids):
+        """
+        Translate content IDs to row indices
 
-        return recommendations
+        Args:
+            content_ids (array-like): Content IDs
 
-    def _calculate_user_vector(self, user_profile):
-        """Calculate user preference vector based on liked content"""
-        liked_content = user_profile.get('liked_content', [])
-        disliked_content = user_profile.get('disliked_content', [])
+        Returns:
+            np.ndarray: Row index of each ID, -1 for unknown or removed IDs
+        """
+        query = _id_array(content_ids)
+        result = np.full(query.shape, -1, dtype=np.intp)
+        if not query.size or not len(self.sorted_ids):
+            return result
 
-        if not liked_content:
-            return np.zeros(self.content_features.shape[1])
+        if query.dtype == object:
+            # Mixed types: only IDs of the index's own kind can match
+            text = self.sorted_ids.dtype.kind == 'U'
+            match = np.array([isinstance(content_id, str) if text
+                              else isinstance(content_id, (int, float, np.number))
+                              for content_id in query], dtype=bool)
+            if match.any():
+                result[match] = self.ids_to_idx(query[match].tolist())
+            return result
 
-        # Get features for liked content
-        liked_indices = [self.content_mapping[content_id] for content_id in
-                        liked_content if content_id in self.content_mapping]
+        if not _comparable_ids(query, self.sorted_ids):
+            return result
 
-        if not liked_indices:
-            return np.zeros(self.content_features.shape[1])
+        positions = np.searchsorted(self.sorted_ids, query)
+        np.minimum(positions, len(self.sorted_ids) - 1, out=positions)
+        found = self.sorted_ids[positions] == query
+        result[found] = self.order[positions[found]]
+        return result
 
-        liked_features = self.content_features[liked_indices]
+    def idx_to_ids(self, indices):
+        """
+        Translate row indices to content IDs
 
-        # Calculate average preference vector
-        user_vector = np.mean(liked_features, axis=0)
+        Args:
+            indices (array-like): Row indices
 
-        # Subtract disliked content if available
-        if disliked_content:
-            disliked_indices = [self.content_mapping[content_id] for content_id in
-                               disliked_content if content_id in self.content_mapping]
+        Returns:
+            np.ndarray: Content ID of each row
+        """
+        return self.ids[np.asarray(indices, dtype=np.intp)]
 
-            if disliked_indices:
-                disliked_features = self.content_features[disliked_indices]
-                user_vector -= 0.5 * np.mean(disliked_features, axis=0)
+    def live_indices(self):
+        """Rows that are not tombstoned, in row order"""
+        return np.sort(self.order)
 
-        return user_vector
+    def append(self, content_ids):
+        """
+        Add rows for content IDs that are not in the index yet
 
-    def explain_recommendation(self, content_id, user_profile):
+        Args:
+            content_ids (array-like): IDs of the new rows, in row order
         """
-        Explain why content was recommended to a user
+        new_ids = _id_array(content_ids)
+        if not len(new_ids):
+            return
+        if len(self.ids) and not _comparable_ids(new_ids, self.ids):
+            raise ValueError("Content IDs must be all strings or all numbers")
+
+        start = len(self.ids)
+        self.ids = np.concatenate([self.ids, new_ids]) if start else new_ids
+
+        new_order = np.argsort(new_ids, kind='stable')
+        new_sorted = new_ids[new_order]
+        positions = np.searchsorted(self.sorted_ids, new_sorted) if len(self.order) else 0
+        # Widen the sorted IDs first so longer string IDs are not truncated
+        self.sorted_ids = np.insert(self.sorted_ids.astype(self.ids.dtype),
+                                    positions, new_sorted)
+        self.order = np.insert(self.order.astype(np.intp), positions, new_order + start)
+
+    def remove(self, content_ids):
+        """
+        Drop content IDs from the lookup; their rows keep their IDs
 
         Args:
-            content_id: Recommended content ID
-            user_profile (dict): User profile
+            content_ids (array-like): IDs to remove (unknown IDs are ignored)
 
         Returns:
-            dict: Explanation with key features and similar liked content
+            np.ndarray: Sorted row indices that were removed
         """
-        if content_id not in self.content_mapping:
-            return {}
+        removed = self.ids_to_idx(content_ids)
+        removed = np.unique(removed[removed >= 0])
+        keep = ~np.isin(self.order, removed)
+        self.order = self.order[keep]
+        self.sorted_ids = self.sorted_ids[keep]
+        return removed
 
-        content_idx = self.content_mapping[content_id]
-        content_vector = self.content_features[content_idx]
 
-        # Find most similar liked content
-        liked_content = user_profile.get('liked_content', [])
-        if not liked_content:
-            return {}
+class _ContentMapping(Mapping):
+    """Read-only content ID -> row index view of a ContentIdIndex"""
 
-        liked_indices = [self.content_mapping[content_id] for content_id in
-                        liked_content if content_id in self.content_mapping]
+    def __init__(self, index):
+        self._index = index
 
-        if not liked_indices:
-            return {}
+    def __getitem__(self, content_id):
+        idx = self._index.ids_to_idx([content_id])[0]
+        if idx < 0:
+            raise KeyError(content_id)
+        return int(idx)
 
-        liked_features = self.content_features[liked_indices]
-        similarities = cosine_similarity([content_vector], liked_features)[0]
+    def __contains__(self, content_id):
+        return content_id in self._index
 
-        # Get most similar liked content
-        most_similar_idx = np.argmax(similarities)
-        most_similar_content_id = liked_content[most_similar_idx]
-        similarity_score = similarities[most_similar_idx]
+    def __iter__(self):
+        return iter(self._index.idx_to_ids(self._index.live_indices()).tolist())
 
-        return {
-            'most_similar_liked': most_similar_content_id,
-            'similarity_score': similarity_score,
-            'explanation': f"Recommended because you liked {most_similar_content_id}"
+    def __len__(self):
+        return len(self._index)
+
+
+class _ReverseContentMapping(Mapping):
+    """Read-only row index -> content ID view of a ContentIdIndex"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        return self._index.idx_to_ids([idx])[0].item()
+
+    def __contains__(self, idx):
+        return (isinstance(idx, (int, np.integer)) and 0 <= idx < len(self._index.ids)
+                and self._index.ids_to_idx(self._index.ids[[idx]])[0] == idx)
+
+    def __iter__(self):
+        return iter(self._index.live_indices().tolist())
+
+    def __len__(self):
+        return len(self._index)
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over L2-normalized features
+
+    Items are clustered with spherical k-means into n_lists coarse cells.
+    A query only scores the items in its nprobe closest cells.
+    """
+
+    # Fitted state written by ContentBasedRecommender.save
+    ARRAYS = ('centroids', 'list_items', 'list_offsets')
+
+    def __init__(self, n_lists=None, nprobe=8, n_iter=10, sample_size=100000,
+                 block_size=65536, seed=0):
+        """
+        Initialize the index
+
+        Args:
+            n_lists (int): Number of coarse cells (default: ~sqrt(n_items))
+            nprobe (int): Cells scored per query; higher means better recall
+                and slower queries
+            n_iter (int): k-means iterations
+            sample_size (int): Items used to train the centroids
+            block_size (int): Items assigned per block during build
+            seed (int): Random seed
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.block_size = block_size
+        self.seed = seed
+        self.centroids = None
+        self.list_items = None
+        self.list_offsets = None
+
+    def _assign(self, features):
+        """Closest centroid for every row, computed block by block"""
+        assignments = np.empty(features.shape[0], dtype=np.int32)
+        for start in range(0, features.shape[0], self.block_size):
+            end = min(start + self.block_size, features.shape[0])
+            scores = np.asarray(features[start:end] @ self.centroids.T)
+            assignments[start:end] = np.argmax(scores, axis=1)
+        return assignments
+
+    def build(self, features):
+        """
+        Train the coarse quantizer and fill the inverted lists
+
+        Args:
+            features: L2-normalized feature matrix (dense or CSR)
+        """
+        rng = np.random.default_rng(self.seed)
+        n_items = features.shape[0]
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(n_items))), n_items)
+
+        sample = features
+        if n_items > self.sample_size:
+            sample = features[np.sort(rng.choice(n_items, self.sample_size,
+                                                 replace=False))]
+
+        initial = rng.choice(sample.shape[0], n_lists, replace=False)
+        self.centroids = np.asarray(
+            sample[initial].toarray() if _issparse(sample) else sample[initial],
+            dtype=np.float32)
+
+        for _ in range(self.n_iter):
+            assignments = self._assign(sample)
+            membership = sp.csr_matrix(
+                (np.ones(sample.shape[0], dtype=np.float32),
+                 (assignments, np.arange(sample.shape[0]))),
+                shape=(n_lists, sample.shape[0]))
+            sums = membership @ sample
+            sums = np.asarray(sums.toarray() if _issparse(sums) else sums,
+                              dtype=np.float32)
+
+            # Keep the previous centroid for cells that lost all members
+            empty = np.asarray(membership.sum(axis=1)).ravel() == 0
+            sums[empty] = self.centroids[empty]
+            self.centroids = _normalize(sums)
+
+        assignments = self._assign(features)
+        self.list_items = np.argsort(assignments, kind='stable').astype(np.int32)
+        self.list_offsets = np.searchsorted(assignments[self.list_items],
+                                            np.arange(n_lists + 1))
+
+    def add(self, features, start_idx):
+        """
+        Append new items to their closest cells without retraining
+
+        Args:
+            features: L2-normalized feature rows of the new items
+            start_idx (int): Item index of the first new row
+        """
+        assignments = self._assign(features)
+        order = np.argsort(assignments, kind='stable')
+
+        # Insert every new item at the end of its cell's list
+        positions = self.list_offsets[assignments[order] + 1]
+        self.list_items = np.insert(self.list_items, positions,
+                                    (start_idx + order).astype(np.int32))
+
+        counts = np.bincount(assignments, minlength=self.centroids.shape[0])
+        self.list_offsets = self.list_offsets + np.concatenate(([0], np.cumsum(counts)))
+
+    def candidates(self, query):
+        """
+        Candidate item indices for a normalized query vector
+
+        Args:
+            query (np.ndarray): 1D query vector
+
+        Returns:
+            np.ndarray: Item indices in the nprobe closest cells
+        """
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        cells, _ = _top_k(self.centroids @ query, nprobe)
+        return np.concatenate([
+            self.list_items[self.list_offsets[cell]:self.list_offsets[cell + 1]]
+            for cell in cells])
+
+
+class LSHIndex:
+    """
+    Random-hyperplane LSH index over L2-normalized features
+
+    Each of n_tables tables hashes items to an n_bits signature of
+    hyperplane signs. A query scores the union of its buckets.
+    """
+
+    # Fitted state written by ContentBasedRecommender.save
+    ARRAYS = ('hyperplanes', 'sorted_keys', 'sorted_items')
+
+    def __init__(self, n_tables=8, n_bits=12, n_probe_bits=0, block_size=65536,
+                 seed=0):
+        """
+        Initialize the index
+
+        Args:
+            n_tables (int): Hash tables; more tables raise recall and the
+                number of scored candidates
+            n_bits (int): Signature bits per table; more bits mean smaller
+                buckets
+            n_probe_bits (int): Extra buckets probed per table by flipping
+                the least confident bits of the query signature
+            block_size (int): Items hashed per block during build
+            seed (int): Random seed
+        """
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probe_bits = n_probe_bits
+        self.block_size = block_size
+        self.seed = seed
+        self.hyperplanes = None
+        self.sorted_keys = None
+        self.sorted_items = None
+
+    def _projections(self, features):
+        """Hyperplane projections of shape (n_rows, n_tables * n_bits)"""
+        return np.asarray(features @ self.hyperplanes)
+
+    def _keys(self, projections):
+        """Pack sign bits into one integer bucket key per table"""
+        bits = (projections > 0).reshape(-1, self.n_tables, self.n_bits)
+        weights = np.left_shift(1, np.arange(self.n_bits, dtype=np.int64))
+        return bits @ weights
+
+    def build(self, features):
+        """
+        Hash every item into the tables
+
+        Args:
+            features: L2-normalized feature matrix (dense or CSR)
+        """
+        rng = np.random.default_rng(self.seed)
+        n_items = features.shape[0]
+        self.hyperplanes = rng.standard_normal(
+            (features.shape[1], self.n_tables * self.n_bits)).astype(np.float32)
+
+        keys = np.empty((self.n_tables, n_items), dtype=np.int64)
+        for start in range(0, n_items, self.block_size):
+            end = min(start + self.block_size, n_items)
+            keys[:, start:end] = self._keys(self._projections(features[start:end])).T
+
+        self.sorted_items = np.argsort(keys, axis=1, kind='stable').astype(np.int32)
+        self.sorted_keys = np.take_along_axis(keys, self.sorted_items, axis=1)
+
+    def add(self, features, start_idx):
+        """
+        Hash new items into the existing tables
+
+        Args:
+            features: L2-normalized feature rows of the new items
+            start_idx (int): Item index of the first new row
+        """
+        keys = self._keys(self._projections(features)).T
+        items = np.arange(start_idx, start_idx + features.shape[0], dtype=np.int32)
+
+        sorted_keys, sorted_items = [], []
+        for table in range(self.n_tables):
+            order = np.argsort(keys[table], kind='stable')
+            positions = np.searchsorted(self.sorted_keys[table], keys[table, order],
+                                        side='right')
+            sorted_keys.append(np.insert(self.sorted_keys[table], positions,
+                                         keys[table, order]))
+            sorted_items.append(np.insert(self.sorted_items[table], positions,
+                                          items[order]))
+
+        self.sorted_keys = np.vstack(sorted_keys)
+        self.sorted_items = np.vstack(sorted_items)
+
+    def candidates(self, query):
+        """
+        Candidate item indices for a normalized query vector
+
+        Args:
+            query (np.ndarray): 1D query vector
+
+        Returns:
+            np.ndarray: Unique item indices sharing a probed bucket
+        """
+        projections = self._projections(query[None, :])
+        keys = self._keys(projections)[0]
+        confidence = np.abs(projections.reshape(self.n_tables, self.n_bits))
+
+        found = []
+        for table in range(self.n_tables):
+            probe_keys = [keys[table]]
+            for bit in np.argsort(confidence[table])[:self.n_probe_bits]:
+                probe_keys.append(keys[table] ^ (1 << int(bit)))
+
+            table_keys = self.sorted_keys[table]
+            for key in probe_keys:
+                lo = np.searchsorted(table_keys, key, side='left')
+                hi = np.searchsorted(table_keys, key, side='right')
+                found.append(self.sorted_items[table, lo:hi])
+
+        return np.unique(np.concatenate(found))
+
+
+ANN_BACKENDS = {
+    'ivf': IVFIndex,
+    'lsh': LSHIndex,
+}
+
+
+class ContentBasedRecommender:
+    """
+    Content-Based Recommendation System for Media & Entertainment
+    Supports movies, TV shows, music, and other content types
+    """
+
+    def __init__(self, content_type='movies', sparse=False, ann_backend=None,
+                 ann_params=None, feature_dtype='float32', label_delimiter=None,
+                 user_cache_size=0, instrument=False, trace_memory=False,
+                 stats_callback=None, quantization=None, rescore_factor=4,
+                 max_categories=None, category_hash_buckets=0, filter_columns=None,
+                 diversity=None, diversity_lambda=0.7, diversity_pool=4,
+                 diversity_field='genres', max_per_category=2, reduction_dim=None):
+        """
+        Initialize the recommender
+
+        Args:
+            content_type (str): 'movies', 'music', 'shows', or 'general'
+            sparse (bool): Keep text, categorical and numerical features in
+                CSR form instead of densifying them. Use this for large
+                catalogs where a dense TF-IDF block would not fit in memory.
+            ann_backend (str): Approximate nearest-neighbor backend used by
+                recommend_content, 'ivf' or 'lsh' (default: exact scoring)
+            ann_params (dict): Keyword arguments for the ANN index, e.g.
+                {'n_lists': 1024, 'nprobe': 16} for 'ivf' or
+                {'n_tables': 8, 'n_bits': 14} for 'lsh'
+            feature_dtype (str): Storage dtype of the L2-normalized feature
+                matrix: 'float32', 'float16' (dense only) or 'float64'
+            label_delimiter (str): Separator for genres/tags given as plain
+                strings such as 'Sci-Fi|Action' (default: one label per
+                string; list literals are always parsed)
+            user_cache_size (int): Number of user preference vectors kept in
+                an LRU cache keyed by the profile's user_id and
+                history_version (0 disables caching). Profiles without both
+                are never cached. Each entry holds two feature-width float32
+                vectors.
+            instrument (bool): Record wall time, peak RSS growth and output
+                array sizes of every pipeline stage in stage_stats
+            trace_memory (bool): Also record the peak Python allocation of
+                every stage with tracemalloc (started on first use; slows
+                allocation-heavy stages noticeably)
+            stats_callback (callable): Called as stats_callback(stage, record)
+                after every instrumented stage, e.g. to forward the record
+                to a metrics system
+            quantization (str): 'int8' keeps an int8 copy of the features
+                (dense only, 4x smaller than float32) for first-pass scoring
+                in recommend_content, recommend_content_batch and
+                get_similar_content. The shortlist is rescored exactly
+                against content_features, which can stay on disk: save()
+                the model and load() it memory-mapped.
+            rescore_factor (int): Shortlist size as a multiple of the number
+                of results requested, trading recall for rescoring reads
+            max_categories (int): Vocabulary limit per categorical field
+                (genres, tags), keeping the most frequent labels (default:
+                no limit)
+            category_hash_buckets (int): Hashed columns per categorical
+                field for labels outside its vocabulary (default: such
+                labels are ignored)
+            filter_columns (list): Extra metadata columns (e.g. 'region')
+                indexed for filtered recommendations, next to the
+                categorical and numerical feature columns that are always
+                indexed
+            diversity (str): Re-rank recommendations for diversity:
+                'mmr' (maximal marginal relevance) or 'category' (at most
+                max_per_category results per label of diversity_field).
+                Default: rank by relevance only.
+            diversity_lambda (float): MMR trade-off between relevance (1.0)
+                and dissimilarity to the results already picked
+            diversity_pool (int): Candidate pool re-ranked for diversity, as
+                a multiple of the number of results requested
+            diversity_field (str): Indexed label field capped by 'category'
+                diversity, e.g. 'genres' or a franchise column listed in
+                filter_columns
+            max_per_category (int): Results allowed per label of
+                diversity_field
+            reduction_dim (int): Project the features onto this many
+                randomized truncated SVD components (64-256 is typical) and
+                score in that dense space. The projection is saved with the
+                model and applied to added content; feature contributions
+                are not reported for reduced features.
+        """
+        if ann_backend is not None and ann_backend not in ANN_BACKENDS:
+            raise ValueError(f"Unknown ANN backend: {ann_backend}")
+        if feature_dtype not in ('float16', 'float32', 'float64'):
+            raise ValueError(f"Unsupported feature dtype: {feature_dtype}")
+        if reduction_dim is not None and reduction_dim < 1:
+            raise ValueError(f"Invalid reduction dimension: {reduction_dim}")
+        # Reduced features are dense even when the pipeline is sparse
+        dense_features = not sparse or reduction_dim is not None
+        if not dense_features and feature_dtype == 'float16':
+            raise ValueError("float16 features are only supported in dense mode")
+        if quantization not in (None, 'int8'):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        if not dense_features and quantization is not None:
+            raise ValueError("Quantization is only supported in dense mode")
+        if diversity not in (None, 'mmr', 'category'):
+            raise ValueError(f"Unknown diversity method: {diversity}")
+
+        self.content_type = content_type
+        self.sparse = sparse
+        self.feature_dtype = np.dtype(feature_dtype)
+        self.label_delimiter = label_delimiter
+        self.content_features = None
+        self.reduction_dim = reduction_dim
+        self.reduction_components = None
+        self.similarity_matrix = None
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+        self.removed_indices = np.empty(0, dtype=np.intp)
+        self.ann_backend = ann_backend
+        self.ann_params = ann_params or {}
+        self.ann_index = None
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.quantized_features = None
+        self.quantization_scales = None
+        self.content_index = ContentIdIndex()
+        self.tfidf_vectorizer = None
+        self.max_categories = max_categories
+        self.category_hash_buckets = category_hash_buckets
+        self.categorical_encoder = None
+        self.filter_columns = list(filter_columns or [])
+        self.diversity = diversity
+        self.diversity_lambda = diversity_lambda
+        self.diversity_pool = diversity_pool
+        self.diversity_field = diversity_field
+        self.max_per_category = max_per_category
+        self.metadata_fields = {}
+        self.metadata_index = None
+        self.text_columns = []
+        self.categorical_columns = []
+        self.numerical_columns = []
+        self.numerical_mean = 0.0
+        self.numerical_std = 1.0
+        self.feature_groups = {}
+        self._encoders_path = None
+        # Arrays prepare_content_stream wrote to its path (see save)
+        self._stream_arrays = {}
+        self.user_cache_size = user_cache_size
+        self._user_cache = OrderedDict()
+        self.user_cache_stats = {'hits': 0, 'misses': 0}
+        self.instrument = instrument
+        self.trace_memory = trace_memory
+        self.stats_callback = stats_callback
+        self.stage_stats = {}
+
+    @property
+    def metadata_index(self):
+        """Inverted metadata index; a loaded model builds it on first use"""
+        if self._metadata_arrays is not None:
+            self._metadata_index = MetadataIndex.from_arrays(
+                self.metadata_fields, *self._metadata_arrays)
+            self._metadata_arrays = None
+        return self._metadata_index
+
+    @metadata_index.setter
+    def metadata_index(self, index):
+        self._metadata_arrays = None
+        self._metadata_index = index
+
+    @property
+    def content_mapping(self):
+        """Read-only content ID -> row index view of content_index"""
+        return _ContentMapping(self.content_index)
+
+    @property
+    def reverse_content_mapping(self):
+        """Read-only row index -> content ID view of content_index"""
+        return _ReverseContentMapping(self.content_index)
+
+    @contextmanager
+    def _stage(self, name):
+        """
+        Measure one pipeline stage when instrumentation is enabled
+
+        Yields a dict; set its 'output' key to the stage's result to record
+        the array's shape and size. Each record holds wall_s,
+        rss_peak_delta_bytes (growth of the process's peak RSS), optionally
+        traced_peak_bytes, and output_shape/output_bytes. stage_stats[name]
+        keeps calls, total_s, max_s and the last record.
+        """
+        stage = {}
+        if not self.instrument:
+            yield stage
+            return
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        rss_start = _peak_rss()
+        start = time.perf_counter()
+
+        yield stage
+
+        record = {'wall_s': time.perf_counter() - start}
+        if rss_start is not None:
+            record['rss_peak_delta_bytes'] = _peak_rss() - rss_start
+        if self.trace_memory:
+            record['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1] - traced_start
+        output = stage.get('output')
+        if output is not None:
+            record['output_shape'] = tuple(output.shape)
+            record['output_bytes'] = _nbytes(output)
+
+        totals = self.stage_stats.setdefault(name, {'calls': 0, 'total_s': 0.0, 'max_s': 0.0})
+        totals['calls'] += 1
+        totals['total_s'] += record['wall_s']
+        totals['max_s'] = max(totals['max_s'], record['wall_s'])
+        totals['last'] = record
+
+        if self.stats_callback is not None:
+            self.stats_callback(name, record)
+
+    def prepare_content_data(self, content_df):
+        """
+        Prepare content data for content-based filtering
+
+        Args:
+            content_df (pd.DataFrame): Content metadata (not modified) with
+                columns:
+                - content_id: Unique identifier
+                - title: Content title
+                - description: Content description/plot
+                - genres: List of genres (optional)
+                - tags: List of tags (optional)
+                - other metadata columns based on content type
+
+        Returns:
+            np.ndarray or scipy.sparse.csr_matrix: L2-normalized content
+                features in feature_dtype (CSR when the recommender was
+                created with sparse=True)
+        """
+        # Keep the first row of every content ID so rows line up with indices
+        if content_df['content_id'].duplicated().any():
+            content_df = content_df.drop_duplicates('content_id')
+        content_df = content_df.reset_index(drop=True)
+
+        # Create content mapping
+        self.content_index = ContentIdIndex(content_df['content_id'])
+
+        self.content_features = self._build_features(content_df, fit=True)
+        self.metadata_index = MetadataIndex()
+        self._index_metadata(content_df)
+        self.removed_indices = np.empty(0, dtype=np.intp)
+        self._stream_arrays = {}
+        self._user_cache.clear()
+        self.similarity_matrix = None
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+
+        self.ann_index = None
+        if self.ann_backend is not None:
+            self.build_ann_index()
+
+        self.quantized_features = None
+        self.quantization_scales = None
+        if self.quantization is not None:
+            self.build_quantized_features()
+
+        return self.content_features
+
+    def prepare_content_stream(self, chunks, path, n_text_features=2 ** 16,
+                               block_size=65536):
+        """
+        Fit on a catalog larger than memory, one chunk at a time
+
+        Text is encoded with a stateless HashingVectorizer instead of TF-IDF,
+        the genre/tag vocabulary grows as chunks arrive and numerical
+        statistics are accumulated on the fly. Raw rows are spilled to disk,
+        then standardized, L2-normalized and written straight into the CSR
+        component files of a saved model in path, which is memory-mapped
+        afterwards. The result can be reopened with load(path).
+
+        Example:
+            chunks = pd.read_csv('catalog.csv', chunksize=100000)
+            # or: (batch.to_pandas() for batch in
+            #      pyarrow.parquet.ParquetFile('catalog.parquet').iter_batches())
+            recommender.prepare_content_stream(chunks, 'model/')
+
+        Args:
+            chunks (iterable): pd.DataFrame chunks with the columns accepted
+                by prepare_content_data
+            path (str): Output directory of the on-disk model
+            n_text_features (int): Hashed text feature columns
+            block_size (int): Rows normalized and written per block
+
+        Returns:
+            scipy.sparse.csr_matrix: Memory-mapped L2-normalized features
+        """
+        if not self.sparse:
+            raise ValueError("Streaming fit requires sparse=True")
+
+        os.makedirs(path, exist_ok=True)
+        spill_paths = {name: os.path.join(path, f'_spill.{name}.bin')
+                       for name in ('data', 'indices', 'row_nnz', 'numerical')}
+
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.tfidf_vectorizer = HashingVectorizer(
+            n_features=n_text_features,
+            stop_words='english',
+            ngram_range=(1, 2),
+            alternate_sign=False
+        )
+        self.content_index = ContentIdIndex()
+        self.metadata_index = MetadataIndex()
+        # Per-field label -> raw column in order of first appearance, and the
+        # frequency of every raw column
+        label_ids = {}
+        label_counts = []
+        # Running count, mean and sum of squared deviations (Chan et al.)
+        n_values, mean, m2 = 0, 0.0, 0.0
+
+        spill = {name: open(spill_path, 'wb')
+                 for name, spill_path in spill_paths.items()}
+        try:
+            for chunk in chunks:
+                if not len(self.content_index.ids):
+                    self._select_columns(chunk)
+                    label_ids = {field: {} for field in self.categorical_columns}
+
+                # Keep the first row of every content ID across all chunks
+                chunk = chunk.drop_duplicates('content_id')
+                known = self.content_index.ids_to_idx(chunk['content_id']) >= 0
+                chunk = chunk[~known].reset_index(drop=True)
+                if chunk.empty:
+                    continue
+
+                self.content_index.append(chunk['content_id'])
+                self._index_metadata(chunk)
+
+                blocks = []
+                text_features = self._process_text_features(chunk, fit=False)
+                if text_features is not None:
+                    blocks.append(text_features)
+
+                if self.categorical_columns:
+                    # Raw columns are numbered in order of first appearance
+                    # here and mapped to the fitted encoder's columns when
+                    # the final matrix is written
+                    rows, columns = [], []
+                    for field, labels in self._label_columns(chunk).items():
+                        field_ids = label_ids[field]
+                        for label, count in labels.value_counts().items():
+                            if label not in field_ids:
+                                field_ids[label] = len(label_counts)
+                                label_counts.append(0)
+                            label_counts[field_ids[label]] += count
+                        rows.append(labels.index.to_numpy())
+                        columns.append(labels.map(field_ids).to_numpy(dtype=np.int64))
+
+                    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+                    columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+                    label_features = sp.csr_matrix(
+                        (np.ones(len(rows)), (rows, columns)),
+                        shape=(len(chunk), len(label_counts)))
+                    label_features.sum_duplicates()
+                    label_features.data[:] = 1
+                    blocks.append(label_features)
+
+                if blocks:
+                    raw = sp.hstack(blocks, format='csr')
+                    raw.data.astype(np.float32).tofile(spill['data'])
+                    raw.indices.astype(np.int32).tofile(spill['indices'])
+                    np.diff(raw.indptr).astype(np.int64).tofile(spill['row_nnz'])
+                else:
+                    np.zeros(len(chunk), dtype=np.int64).tofile(spill['row_nnz'])
+
+                if self.numerical_columns:
+                    values = chunk.reindex(
+                        columns=self.numerical_columns).fillna(0).values.astype(np.float64)
+                    values.tofile(spill['numerical'])
+
+                    chunk_n, chunk_mean = values.size, values.mean()
+                    chunk_m2 = ((values - chunk_mean) ** 2).sum()
+                    delta = chunk_mean - mean
+                    total = n_values + chunk_n
+                    m2 += chunk_m2 + delta ** 2 * n_values * chunk_n / total
+                    mean += delta * chunk_n / total
+                    n_values = total
+        finally:
+            for f in spill.values():
+                f.close()
+
+        n_items = len(self.content_index.ids)
+        if not n_items:
+            raise ValueError("No content in the stream")
+
+        self.numerical_mean = mean
+        self.numerical_std = np.sqrt(m2 / n_values) if n_values else 1.0
+
+        # Same vocabularies as an in-memory fit over the whole catalog
+        label_counts = np.asarray(label_counts, dtype=np.int64)
+        label_columns = np.full(len(label_counts), -1, dtype=np.int64)
+        self.categorical_encoder = None
+        if self.categorical_columns:
+            self.categorical_encoder = CategoricalEncoder(
+                self.max_categories, self.category_hash_buckets).fit_counts({
+                    field: pd.Series(label_counts[list(field_ids.values())],
+                                     index=pd.Index(list(field_ids), dtype=object))
+                    for field, field_ids in label_ids.items()})
+            for field, field_ids in label_ids.items():
+                label_columns[list(field_ids.values())] = \
+                    self.categorical_encoder.columns(field, list(field_ids))
+
+        try:
+            self._write_stream_features(path, spill_paths, n_items, label_columns,
+                                        block_size)
+        finally:
+            for spill_path in spill_paths.values():
+                os.remove(spill_path)
+
+        if self.reduction_dim is not None:
+            # Reduced rows go straight to the model's dense feature file
+            feature_path = os.path.join(path, 'content_features.npy')
+            with self._stage('reduction') as stage:
+                self._fit_reduction(self.content_features)
+                reduced = np.lib.format.open_memmap(
+                    feature_path, mode='w+', dtype=self.feature_dtype,
+                    shape=(n_items, self.reduction_components.shape[0]))
+                self._reduce(self.content_features, block_size, out=reduced)
+                reduced.flush()
+                del reduced
+                self.content_features = stage['output'] = np.load(feature_path,
+                                                                  mmap_mode='c')
+            # The CSR components are not part of a reduced model
+            for name in ('data', 'indices', 'indptr'):
+                os.remove(os.path.join(path, f'content_features.{name}.npy'))
+
+        self.removed_indices = np.empty(0, dtype=np.intp)
+        self._user_cache.clear()
+        self.similarity_matrix = None
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+
+        self.ann_index = None
+        if self.ann_backend is not None:
+            self.build_ann_index()
+
+        # The feature files in path are complete; save() need not copy them
+        features = self.content_features
+        self._stream_arrays = (
+            {'content_features': features} if not _issparse(features) else
+            {f'content_features.{name}': getattr(features, name)
+             for name in ('data', 'indices', 'indptr')})
+        self.save(path)
+        return self.content_features
+
+    def _write_stream_features(self, path, spill_paths, n_items, label_columns,
+                               block_size):
+        """Standardize, normalize and write spilled rows as memory-mapped CSR"""
+        n_text = self.tfidf_vectorizer.n_features if self.text_columns else 0
+        n_labels = (self.categorical_encoder.n_features
+                    if self.categorical_encoder is not None else 0)
+        n_numerical = len(self.numerical_columns)
+
+        row_nnz = np.fromfile(spill_paths['row_nnz'], dtype=np.int64)
+        spill_indptr = np.concatenate(([0], np.cumsum(row_nnz)))
+        if spill_indptr[-1]:
+            spill_data = np.memmap(spill_paths['data'], dtype=np.float32, mode='r')
+            spill_indices = np.memmap(spill_paths['indices'], dtype=np.int32, mode='r')
+        else:
+            spill_data = np.empty(0, dtype=np.float32)
+            spill_indices = np.empty(0, dtype=np.int32)
+        if n_numerical:
+            spill_numerical = np.memmap(spill_paths['numerical'], dtype=np.float64,
+                                        mode='r', shape=(n_items, n_numerical))
+
+        # Every numerical value is stored explicitly. Dropped labels and
+        # labels sharing a hash bucket can only shrink the spilled entries,
+        # so this is an upper bound and the files are truncated at the end.
+        total_nnz = int(spill_indptr[-1]) + n_items * n_numerical
+        component_paths = {name: os.path.join(path, f'content_features.{name}.npy')
+                           for name in ('data', 'indices', 'indptr')}
+        data = np.lib.format.open_memmap(component_paths['data'], mode='w+',
+                                         dtype=self.feature_dtype, shape=(total_nnz,))
+        indices = np.lib.format.open_memmap(component_paths['indices'], mode='w+',
+                                            dtype=np.int32, shape=(total_nnz,))
+        indptr = np.lib.format.open_memmap(component_paths['indptr'], mode='w+',
+                                           dtype=np.int64, shape=(n_items + 1,))
+        indptr[0] = 0
+
+        for start in range(0, n_items, block_size):
+            end = min(start + block_size, n_items)
+            lo, hi = spill_indptr[start], spill_indptr[end]
+
+            block_indices = np.array(spill_indices[lo:hi], dtype=np.int64)
+            block_rows = np.repeat(np.arange(end - start), row_nnz[start:end])
+            is_label = block_indices >= n_text
+            block_indices[is_label] = label_columns[block_indices[is_label] - n_text]
+            keep = block_indices >= 0
+            block_indices[is_label & keep] += n_text
+
+            raw = sp.csr_matrix(
+                (spill_data[lo:hi][keep], (block_rows[keep], block_indices[keep])),
+                shape=(end - start, n_text + n_labels))
+            raw.sum_duplicates()
+            raw.data[raw.indices >= n_text] = 1
+            blocks = [raw]
+
+            if n_numerical:
+                values = (spill_numerical[start:end] - self.numerical_mean) / (
+                    self.numerical_std + 1e-8)
+                blocks.append(sp.csr_matrix(
+                    (values.ravel(), np.tile(np.arange(n_numerical), end - start),
+                     np.arange(0, (end - start) * n_numerical + 1, n_numerical)),
+                    shape=(end - start, n_numerical)))
+
+            block = _normalize(sp.hstack(blocks, format='csr'))
+            offset = indptr[start]
+            data[offset:offset + block.nnz] = block.data
+            indices[offset:offset + block.nnz] = block.indices
+            indptr[start + 1:end + 1] = offset + block.indptr[1:]
+
+        nnz = int(indptr[-1])
+        for component in (data, indices, indptr):
+            component.flush()
+        del data, indices, indptr
+
+        if nnz < total_nnz:
+            for name in ('data', 'indices'):
+                _truncate_npy(component_paths[name], nnz)
+
+        components = {name: np.load(component_path, mmap_mode='c')
+                      for name, component_path in component_paths.items()}
+        self.content_features = sp.csr_matrix(
+            (components['data'], components['indices'], components['indptr']),
+            shape=(n_items, n_text + n_labels + n_numerical))
+
+        self.feature_groups = {}
+        for group, width, start in [('text', n_text, 0),
+                                    ('categorical', n_labels, n_text),
+                                    ('numerical', n_numerical, n_text + n_labels)]:
+            if width:
+                self.feature_groups[group] = (start, start + width)
+
+    def _build_features(self, content_df, fit):
+        """
+        Turn content metadata into L2-normalized feature rows
+
+        Args:
+            content_df (pd.DataFrame): Content metadata, one row per item
+            fit (bool): Fit the encoders (True) or reuse the frozen
+                vocabulary and statistics of the last fit (False)
+
+        Returns:
+            np.ndarray or scipy.sparse.csr_matrix: Feature rows in
+                feature_dtype
+        """
+        if fit:
+            self._select_columns(content_df)
+
+        # Process text features
+        with self._stage('text_vectorization') as stage:
+            text_features = stage['output'] = self._process_text_features(content_df, fit)
+
+        # Process categorical features
+        with self._stage('categorical_encoding') as stage:
+            categorical_features = stage['output'] = self._process_categorical_features(
+                content_df, fit)
+
+        # Process numerical features
+        with self._stage('numeric_scaling') as stage:
+            numerical_features = stage['output'] = self._process_numerical_features(
+                content_df, fit)
+
+        # Combine all features and normalize once, so cosine similarity is
+        # a plain dot product at query time
+        with self._stage('feature_combination') as stage:
+            combined_features = self._combine_features(
+                text_features, categorical_features, numerical_features)
+            stage['output'] = _normalize(combined_features).astype(
+                self.feature_dtype, copy=False)
+        features = stage['output']
+
+        if self.reduction_dim is not None:
+            with self._stage('reduction') as stage:
+                if fit:
+                    self._fit_reduction(features)
+                features = stage['output'] = self._reduce(features)
+
+        return features
+
+    def _fit_reduction(self, features):
+        """Fit the randomized truncated SVD projection of the feature rows"""
+        from sklearn.utils.extmath import randomized_svd
+
+        # No centering, unlike PCA: the projection has to preserve dot
+        # products, not variance around the mean
+        n_components = min(self.reduction_dim, *features.shape)
+        _, _, components = randomized_svd(features, n_components, random_state=0)
+        self.reduction_components = components.astype(np.float32)
+
+    def _reduce(self, features, block_size=65536, out=None):
+        """
+        Project feature rows onto the SVD components and renormalize them,
+        so scores stay cosine similarities in the reduced space
+
+        Args:
+            features: L2-normalized feature rows (dense or CSR, possibly
+                memory-mapped)
+            block_size (int): Rows projected per block
+            out (np.ndarray): Array the reduced rows are written to, e.g. a
+                memory-mapped file (default: a new array)
+
+        Returns:
+            np.ndarray: Dense reduced rows in feature_dtype
+        """
+        # Column ranges of the feature groups do not survive the projection
+        self.feature_groups = {}
+
+        components = self.reduction_components.T
+        reduced = out
+        if reduced is None:
+            reduced = np.empty((features.shape[0], components.shape[1]),
+                               dtype=self.feature_dtype)
+        for start in range(0, features.shape[0], block_size):
+            block = features[start:start + block_size]
+            if not _issparse(block):
+                block = block.astype(np.float32)
+            reduced[start:start + block_size] = _normalize(_dot(block, components))
+        return reduced
+
+    def _select_columns(self, content_df):
+        """Pick the text, categorical and numerical columns used as features"""
+        text_columns = ['title', 'description']
+        self.text_columns = [col for col in text_columns if col in content_df.columns]
+
+        # Every available categorical field gets its own namespace
+        categorical_columns = ['genres', 'tags']
+        self.categorical_columns = [col for col in categorical_columns
+                                    if col in content_df.columns]
+
+        numerical_columns = {
+            'movies': ['year', 'duration', 'rating', 'vote_count'],
+            'music': ['year', 'duration', 'tempo', 'energy', 'danceability'],
+            'shows': ['year', 'seasons', 'episodes', 'rating'],
+            'general': ['year', 'rating', 'popularity']
+        }
+        self.numerical_columns = [col for col in numerical_columns.get(
+            self.content_type, []) if col in content_df.columns]
+
+        # Metadata indexed for filtered recommendations
+        self.metadata_fields = {col: 'labels' for col in self.categorical_columns}
+        self.metadata_fields.update({col: 'numerical' for col in self.numerical_columns})
+        for col in self.filter_columns:
+            if col in content_df.columns and col not in self.metadata_fields:
+                self.metadata_fields[col] = ('numerical'
+                                             if pd.api.types.is_numeric_dtype(content_df[col])
+                                             else 'labels')
+
+    def _process_text_features(self, content_df, fit=True):
+        """Process text-based features using TF-IDF"""
+        if not self.text_columns:
+            return None
+
+        # Create combined text field column-wise (columns missing from an
+        # update are empty)
+        combined_text = None
+        for col in self.text_columns:
+            if col in content_df.columns:
+                column = content_df[col].fillna('').astype(str)
+            else:
+                column = pd.Series('', index=content_df.index)
+            combined_text = (column if combined_text is None
+                             else combined_text.str.cat(column, sep=' '))
+
+        if fit:
+            # Initialize TF-IDF vectorizer
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            self.tfidf_vectorizer = TfidfVectorizer(
+                max_features=5000,
+                stop_words='english',
+                ngram_range=(1, 2),
+                min_df=2,
+                max_df=0.8
+            )
+
+            # Fit and transform text features
+            text_features = self.tfidf_vectorizer.fit_transform(combined_text)
+        else:
+            # Transform with the frozen vocabulary
+            text_features = self.tfidf_vectorizer.transform(combined_text)
+
+        if self.sparse:
+            return text_features.tocsr()
+
+        return text_features.toarray()
+
+    def _process_categorical_features(self, content_df, fit=True):
+        """Process categorical features like genres, tags"""
+        if not self.categorical_columns:
+            return None
+
+        # One sparse block with a column range per field, built from
+        # (row, label) pairs in one shot
+        label_columns = self._label_columns(content_df)
+        if fit:
+            self.categorical_encoder = CategoricalEncoder(
+                self.max_categories, self.category_hash_buckets).fit(label_columns)
+
+        categorical_features = self.categorical_encoder.transform(
+            label_columns, len(content_df))
+
+        if self.sparse:
+            return categorical_features
+
+        return categorical_features.toarray()
+
+    def _label_columns(self, content_df):
+        """Parsed labels of every categorical field present in content_df"""
+        # Handle lists, list literals and plain strings without eval
+        return {col: _parse_label_column(content_df[col], self.label_delimiter)
+                for col in self.categorical_columns if col in content_df.columns}
+
+    def _index_metadata(self, content_df):
+        """Append the metadata of content_df's rows to the metadata index"""
+        with self._stage('metadata_index'):
+            label_columns, numerical_columns = {}, {}
+            for field, kind in self.metadata_fields.items():
+                if field not in content_df.columns:
+                    continue
+                if kind == 'labels':
+                    label_columns[field] = _parse_label_column(content_df[field],
+                                                               self.label_delimiter)
+                else:
+                    numerical_columns[field] = pd.to_numeric(
+                        content_df[field], errors='coerce').to_numpy(dtype=np.float64)
+
+            self.metadata_index.add(label_columns, numerical_columns, len(content_df))
+
+    def _process_numerical_features(self, content_df, fit=True):
+        """Process numerical features like ratings, year, duration"""
+        if not self.numerical_columns:
+            return None
+
+        numerical_features = content_df.reindex(
+            columns=self.numerical_columns).fillna(0).values
+
+        # Normalize numerical features with the statistics of the last fit
+        if fit:
+            self.numerical_mean = numerical_features.mean()
+            self.numerical_std = numerical_features.std()
+
+        numerical_features = (numerical_features - self.numerical_mean) / (
+            self.numerical_std + 1e-8)
+
+        return numerical_features
+
+    def _combine_features(self, text_features, categorical_features, numerical_features):
+        """Combine different feature types into a single feature matrix"""
+        features_list = []
+        groups = []
+
+        if text_features is not None:
+            features_list.append(text_features)
+            groups.append('text')
+
+        if categorical_features is not None:
+            features_list.append(categorical_features)
+            groups.append('categorical')
+
+        if numerical_features is not None:
+            features_list.append(numerical_features)
+            groups.append('numerical')
+
+        if not features_list:
+            raise ValueError("No features available for content-based filtering")
+
+        # Column range of every feature group, used to explain scores
+        self.feature_groups = {}
+        start = 0
+        for group, features in zip(groups, features_list):
+            self.feature_groups[group] = (start, start + features.shape[1])
+            start += features.shape[1]
+
+        # Concatenate all features
+        if self.sparse:
+            # Numerical block is small and dense; only it gets converted
+            combined_features = sp.hstack(
+                [sp.csr_matrix(features) for features in features_list],
+                format='csr')
+        else:
+            combined_features = np.hstack(features_list)
+
+        return combined_features
+
+    def compute_similarity(self, top_k=None, block_size=1024, n_jobs=1):
+        """
+        Compute content similarity matrix
+
+        Args:
+            top_k (int): If set, build a top-K neighbor index instead of the
+                full N x N matrix. Row blocks are scored one at a time and
+                only the K best neighbors of each item are kept, so memory
+                is O(N * K) instead of O(N^2).
+            block_size (int): Rows scored per block when top_k is set
+            n_jobs (int): Worker processes for the top-K build (-1: one per
+                CPU). The feature matrix is placed in shared memory once and
+                workers return only their blocks' neighbor lists.
+
+        Returns:
+            np.ndarray or tuple: The N x N similarity matrix, or
+                (neighbor_indices, neighbor_scores) when top_k is set
+        """
+        if top_k is None:
+            self.neighbor_indices = None
+            self.neighbor_scores = None
+            with self._stage('similarity') as stage:
+                self.similarity_matrix = stage['output'] = _dot(
+                    self.content_features, self.content_features.T)
+            return self.similarity_matrix
+
+        self.similarity_matrix = None
+        with self._stage('neighbor_index') as stage:
+            self._build_neighbor_index(top_k, block_size, n_jobs)
+            stage['output'] = self.neighbor_indices
+        return self.neighbor_indices, self.neighbor_scores
+
+    def _item_vector(self, content_idx):
+        """Dense float32 feature row of one item"""
+        row = self.content_features[content_idx]
+        row = row.toarray().ravel() if _issparse(row) else row
+        return np.asarray(row, dtype=np.float32)
+
+    def build_ann_index(self):
+        """
+        Build the approximate nearest-neighbor index over the fitted features
+
+        Called by prepare_content_data when an ann_backend is configured.
+        Recall/latency knobs (nprobe, n_tables, ...) can be changed on
+        self.ann_index afterwards without a rebuild where they only affect
+        queries.
+
+        Returns:
+            IVFIndex or LSHIndex: The built index
+        """
+        with self._stage('ann_index'):
+            self.ann_index = ANN_BACKENDS[self.ann_backend](**self.ann_params)
+            self.ann_index.build(self.content_features)
+        return self.ann_index
+
+    def build_quantized_features(self):
+        """
+        Quantize the fitted features for first-pass scoring
+
+        Called by prepare_content_data when quantization is configured. Can
+        also be called on a loaded, memory-mapped model after setting
+        self.quantization; the float features are read one block at a time.
+
+        Returns:
+            np.ndarray: int8 codes, one row per item
+        """
+        if _issparse(self.content_features):
+            raise ValueError("Quantization is only supported in dense mode")
+
+        with self._stage('quantization') as stage:
+            self.quantized_features, self.quantization_scales = _quantize_int8(
+                self.content_features)
+            stage['output'] = self.quantized_features
+        return self.quantized_features
+
+    def _quantized_search(self, query, k, exclude=()):
+        """Shortlist with int8 scores, then rescore the shortlist exactly"""
+        scores = _dot(self.quantized_features, query) * self.quantization_scales
+        shortlist, shortlist_scores = _top_k(
+            scores, k * self.rescore_factor,
+            exclude=np.concatenate([np.asarray(exclude, dtype=np.intp),
+                                    self.removed_indices]))
+
+        # Drop masked entries (short catalogs) and read the float rows in
+        # file order, which matters when they are memory-mapped
+        shortlist = np.sort(shortlist[np.isfinite(shortlist_scores)])
+        exact = _dot(self.content_features[shortlist], query).ravel()
+
+        top, top_scores = _top_k(exact, k)
+        return shortlist[top], top_scores
+
+    def _ann_search(self, query, k, exclude=()):
+        """Exactly rescore the ANN candidates of a query and keep the top k"""
+        candidates = self.ann_index.candidates(query)
+        exclude = np.concatenate([np.asarray(exclude, dtype=np.intp),
+                                  self.removed_indices])
+        candidates = candidates[~np.isin(candidates, exclude)]
+        scores = _dot(self.content_features[candidates], query).ravel()
+
+        top, top_scores = _top_k(scores, k)
+        return candidates[top], top_scores
+
+    def _build_neighbor_index(self, top_k, block_size, n_jobs=1):
+        """Stream row blocks of the similarity matrix and keep top-K per item"""
+        n_items = self.content_features.shape[0]
+        k = min(top_k, n_items - 1)
+
+        self.neighbor_indices = np.empty((n_items, k), dtype=np.int32)
+        self.neighbor_scores = np.empty((n_items, k), dtype=np.float32)
+
+        if k <= 0:
+            return
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+
+        # Workers are forked so they can resolve this module's functions even
+        # though the template file name is not importable; without fork the
+        # build runs in-process
+        if n_jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            self._build_neighbor_index_parallel(k, block_size, n_jobs)
+            return
+
+        for start in range(0, n_items, block_size):
+            end = min(start + block_size, n_items)
+            indices, scores = self._neighbor_rows(np.arange(start, end), k)
+            self.neighbor_indices[start:end] = indices
+            self.neighbor_scores[start:end] = scores
+
+    def _build_neighbor_index_parallel(self, k, block_size, n_jobs):
+        """Score row blocks in a process pool over a shared-memory feature matrix"""
+        features = self.content_features
+        segments = []
+        try:
+            if _issparse(features):
+                feature_specs = [_share_array(np.asarray(array), segments) for array in
+                                 (features.data, features.indices, features.indptr)]
+            else:
+                feature_specs = [_share_array(np.asarray(features), segments)]
+
+            n_items = features.shape[0]
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_neighbor_worker,
+                    initargs=(feature_specs, features.shape, self.removed_indices)) as pool:
+                futures = [pool.submit(_neighbor_block_task, start,
+                                       min(start + block_size, n_items), k)
+                           for start in range(0, n_items, block_size)]
+                for future in futures:
+                    start, indices, scores = future.result()
+                    self.neighbor_indices[start:start + len(indices)] = indices
+                    self.neighbor_scores[start:start + len(indices)] = scores
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+
+    def _neighbor_rows(self, rows, k):
+        """Exact top-k neighbors of the given items against the live catalog"""
+        return _neighbor_block(self.content_features, rows, k, self.removed_indices)
+
+    def add_content(self, content_df):
+        """
+        Add new content without refitting the encoders
+
+        New rows are transformed with the frozen TF-IDF vocabulary, genre
+        labels and numerical statistics of the last fit, appended to the
+        feature store and patched into the similarity structures.
+
+        Args:
+            content_df (pd.DataFrame): Metadata of content IDs that are not
+                in the catalog yet, same columns as prepare_content_data
+
+        Returns:
+            int: Number of items added
+        """
+        content_df = self._incoming_content(content_df)
+        content_ids = content_df['content_id']
+        known = content_ids[self.content_index.ids_to_idx(content_ids) >= 0].tolist()
+        if known:
+            raise ValueError(
+                f"Content already in the catalog, use update_content: {known[:10]}")
+
+        self._append_content(content_df)
+        return len(content_df)
+
+    def update_content(self, content_df):
+        """
+        Replace the metadata of existing content
+
+        The old feature rows are tombstoned and the new ones appended, so
+        the content keeps its ID but moves to a new internal index.
+
+        Args:
+            content_df (pd.DataFrame): Metadata of content IDs already in the
+                catalog, same columns as prepare_content_data
+
+        Returns:
+            int: Number of items updated
+        """
+        content_df = self._incoming_content(content_df)
+        content_ids = content_df['content_id']
+        unknown = content_ids[self.content_index.ids_to_idx(content_ids) < 0].tolist()
+        if unknown:
+            raise ValueError(f"Unknown content, use add_content: {unknown[:10]}")
+
+        removed = self._tombstone(content_df['content_id'])
+        self._append_content(content_df)
+        self._repair_neighbors(removed)
+        return len(content_df)
+
+    def remove_content(self, content_ids):
+        """
+        Remove content from the catalog
+
+        Rows are tombstoned rather than deleted; call compact() to reclaim
+        their memory.
+
+        Args:
+            content_ids (list): Content IDs to remove (unknown IDs are ignored)
+
+        Returns:
+            int: Number of items removed
+        """
+        removed = self._tombstone(content_ids)
+        self._repair_neighbors(removed)
+        return len(removed)
+
+    def compact(self):
+        """
+        Drop tombstoned rows and rebuild the similarity structures
+
+        This is the periodic maintenance step for a catalog that receives
+        incremental updates. It keeps the fitted encoders; to refresh the
+        vocabulary as well, refit with prepare_content_data on the full
+        catalog.
+
+        Returns:
+            int: Number of rows dropped
+        """
+        n_dropped = len(self.removed_indices)
+        if not n_dropped:
+            return 0
+
+        self._take_rows(self.content_index.live_indices())
+        return n_dropped
+
+    def _take_rows(self, rows):
+        """Keep only the given rows, renumbered from 0, and rebuild the indexes"""
+        self.content_features = self.content_features[rows]
+        self.content_index = ContentIdIndex(self.content_index.idx_to_ids(rows))
+        if self.metadata_index is not None:
+            self.metadata_index = self.metadata_index.take(rows)
+        self.removed_indices = np.empty(0, dtype=np.intp)
+        self._user_cache.clear()
+
+        if self.similarity_matrix is not None:
+            self.compute_similarity()
+        if self.neighbor_indices is not None:
+            self.compute_similarity(top_k=self.neighbor_indices.shape[1])
+        if self.ann_index is not None:
+            self.build_ann_index()
+        if self.quantized_features is not None:
+            self.build_quantized_features()
+
+    def shard(self, n_shards):
+        """
+        Split the live catalog into recommenders over disjoint row ranges
+
+        Every shard keeps the fitted encoders and settings and rebuilds its
+        own ANN, neighbor and int8 structures over its rows. Save each shard
+        and serve it with serve_shard behind a ShardedRecommender.
+
+        Args:
+            n_shards (int): Number of shards
+
+        Returns:
+            list: ContentBasedRecommender per shard
+        """
+        if self.content_features is None:
+            raise ValueError("Call prepare_content_data before sharding")
+
+        shards = []
+        for rows in np.array_split(self.content_index.live_indices(), n_shards):
+            shard = copy.copy(self)
+            shard._user_cache = OrderedDict()
+            shard.user_cache_stats = {'hits': 0, 'misses': 0}
+            shard.stage_stats = {}
+            shard._take_rows(rows)
+            shards.append(shard)
+        return shards
+
+    def _incoming_content(self, content_df):
+        """Validate and copy content passed to the incremental update methods"""
+        if self.content_features is None:
+            raise ValueError("Call prepare_content_data before updating content")
+
+        if self._encoders_path is not None:
+            # Encoders of a loaded model are only read when first needed
+            with open(self._encoders_path, 'rb') as f:
+                self.tfidf_vectorizer, self.categorical_encoder = pickle.load(f)
+            self._encoders_path = None
+
+        return content_df.drop_duplicates('content_id', keep='last').reset_index(drop=True)
+
+    def _append_content(self, content_df):
+        """Append feature rows for new content and patch the neighbor structures"""
+        # Cached user vectors may reference content that was unknown until now
+        self._user_cache.clear()
+
+        new_features = self._build_features(content_df, fit=False)
+        start = self.content_features.shape[0]
+        new_rows = np.arange(start, start + new_features.shape[0])
+
+        if _issparse(self.content_features):
+            self.content_features = sp.vstack(
+                [self.content_features, new_features], format='csr')
+        else:
+            self.content_features = np.vstack([self.content_features, new_features])
+
+        self.content_index.append(content_df['content_id'])
+        if self.metadata_index is not None:
+            self._index_metadata(content_df)
+
+        if self.ann_index is not None:
+            self.ann_index.add(new_features, start)
+
+        if self.quantized_features is not None:
+            codes, scales = _quantize_int8(new_features)
+            self.quantized_features = np.vstack([self.quantized_features, codes])
+            self.quantization_scales = np.concatenate([self.quantization_scales, scales])
+
+        if self.similarity_matrix is None and self.neighbor_indices is None:
+            return
+
+        block = new_features if _issparse(new_features) else new_features.astype(np.float32)
+        new_scores = _dot(self.content_features, block.T).astype(np.float32, copy=False)
+        new_scores[self.removed_indices] = -np.inf
+
+        if self.similarity_matrix is not None:
+            n_items = self.content_features.shape[0]
+            similarity_matrix = np.empty((n_items, n_items),
+                                         dtype=self.similarity_matrix.dtype)
+            similarity_matrix[:start, :start] = self.similarity_matrix
+            similarity_matrix[:, start:] = new_scores
+            similarity_matrix[start:, :] = new_scores.T
+            self.similarity_matrix = similarity_matrix
+
+        if self.neighbor_indices is not None and self.neighbor_indices.shape[1]:
+            k = self.neighbor_indices.shape[1]
+
+            # Existing items only change if a new item beats their K-th neighbor
+            old_scores = new_scores[:start]
+            affected = np.flatnonzero(
+                (old_scores > self.neighbor_scores[:, -1:]).any(axis=1))
+            merged_indices = np.hstack([
+                self.neighbor_indices[affected],
+                np.broadcast_to(new_rows, (len(affected), len(new_rows)))])
+            merged_scores = np.hstack([self.neighbor_scores[affected],
+                                       old_scores[affected]])
+            top, top_scores = _top_k_rows(merged_scores, k)
+
+            neighbor_indices = np.empty((start + len(new_rows), k), dtype=np.int32)
+            neighbor_scores = np.empty((start + len(new_rows), k), dtype=np.float32)
+            neighbor_indices[:start] = self.neighbor_indices
+            neighbor_scores[:start] = self.neighbor_scores
+            neighbor_indices[affected] = np.take_along_axis(merged_indices, top, axis=1)
+            neighbor_scores[affected] = top_scores
+            neighbor_indices[start:], neighbor_scores[start:] = self._neighbor_rows(
+                new_rows, k)
+
+            self.neighbor_indices = neighbor_indices
+            self.neighbor_scores = neighbor_scores
+
+    def _tombstone(self, content_ids):
+        """Mark content rows as removed and drop them from the ID index"""
+        self._user_cache.clear()
+
+        removed = self.content_index.remove(content_ids)
+        self.removed_indices = np.union1d(self.removed_indices, removed)
+
+        if self.similarity_matrix is not None:
+            self.similarity_matrix[:, removed] = -np.inf
+
+        return removed
+
+    def _repair_neighbors(self, removed):
+        """Recompute neighbor lists that pointed at removed items"""
+        if (self.neighbor_indices is None or not len(removed)
+                or not self.neighbor_indices.shape[1]):
+            return
+
+        affected = np.flatnonzero(np.isin(self.neighbor_indices, removed).any(axis=1))
+        affected = np.setdiff1d(affected, self.removed_indices)
+        k = self.neighbor_indices.shape[1]
+
+        for start in range(0, len(affected), 1024):
+            rows = affected[start:start + 1024]
+            self.neighbor_indices[rows], self.neighbor_scores[rows] = \
+                self._neighbor_rows(rows, k)
+
+    def get_similar_content(self, content_id, n_similar=10):
+        """
+        Get similar content based on content features
+
+        Args:
+            content_id: Original content ID
+            n_similar (int): Number of similar items to return
+
+        Returns:
+            list: List of (content_id, similarity_score) tuples
+        """
+        content_idx = self.content_index.ids_to_idx([content_id])[0]
+        if content_idx < 0:
+            return []
+
+        if self.neighbor_indices is not None:
+            # Serve from the precomputed top-K neighbor index
+            similar_indices = self.neighbor_indices[content_idx, :n_similar]
+            similar_scores = self.neighbor_scores[content_idx, :n_similar]
+            # Removed items score -inf when fewer live neighbors remain
+            keep = np.isfinite(similar_scores)
+            return list(zip(self.content_index.idx_to_ids(similar_indices[keep]).tolist(),
+                            similar_scores[keep]))
+
+        if self.similarity_matrix is None and self.ann_index is not None:
+            query = self._item_vector(content_idx)
+            similar_indices, similar_scores = self._ann_search(
+                query, n_similar, exclude=[content_idx])
+            return list(zip(self.content_index.idx_to_ids(similar_indices).tolist(),
+                            similar_scores))
+
+        if self.similarity_matrix is None and self.quantized_features is not None:
+            query = self._item_vector(content_idx)
+            similar_indices, similar_scores = self._quantized_search(
+                query, n_similar, exclude=[content_idx])
+            return list(zip(self.content_index.idx_to_ids(similar_indices).tolist(),
+                            similar_scores))
+
+        if self.similarity_matrix is None:
+            # No precomputed structure: score the item against the catalog
+            return self.get_similar_content_batch([content_id], n_similar)[0]
+
+        similarities = self.similarity_matrix[content_idx]
+
+        # Get top similar content (excluding itself). The row is a view into
+        # the similarity matrix, so take one extra entry instead of masking.
+        similar_indices, similar_scores = _top_k(similarities, n_similar + 1)
+        keep = (similar_indices != content_idx) & np.isfinite(similar_scores)
+
+        similar_ids = self.content_index.idx_to_ids(similar_indices[keep][:n_similar])
+        return list(zip(similar_ids.tolist(), similar_scores[keep][:n_similar]))
+
+    def get_similar_content_batch(self, content_ids, n_similar=10, block_size=256):
+        """
+        Get similar content for many items at once
+
+        Items are served one by one from the neighbor index, ANN index,
+        quantized features or similarity matrix when one exists. Otherwise
+        the items' feature rows are scored against the catalog with one
+        matrix product per block of items.
+
+        Args:
+            content_ids (list): Original content IDs
+            n_similar (int): Number of similar items per content ID
+            block_size (int): Items scored per matrix product
+
+        Returns:
+            list: One list of (content_id, similarity_score) tuples per
+                content ID (empty for unknown IDs), in the same order
+        """
+        similar_content = [[] for _ in content_ids]
+        indices = self.content_index.ids_to_idx(content_ids)
+        positions = np.flatnonzero(indices >= 0)
+
+        if (self.neighbor_indices is not None or self.similarity_matrix is not None
+                or self.ann_index is not None or self.quantized_features is not None):
+            for position in positions:
+                similar_content[position] = self.get_similar_content(
+                    content_ids[position], n_similar)
+            return similar_content
+
+        features = self.content_features
+        k = min(n_similar, features.shape[0])
+
+        for block_start in range(0, len(positions), block_size):
+            block = positions[block_start:block_start + block_size]
+            rows = indices[block]
+
+            queries = features[rows]
+            if not _issparse(queries):
+                queries = queries.astype(np.float32)
+
+            with self._stage('scoring') as stage:
+                block_scores = stage['output'] = _dot(features, queries.T).T
+            block_scores[np.arange(len(rows)), rows] = -np.inf
+            block_scores[:, self.removed_indices] = -np.inf
+
+            with self._stage('top_k'):
+                top_indices, top_scores = _top_k_rows(block_scores, k)
+            top_ids = self.content_index.idx_to_ids(top_indices).tolist()
+
+            for row, position in enumerate(block):
+                similar_content[position] = [
+                    (content_id, score)
+                    for content_id, score in zip(top_ids[row], top_scores[row])
+                    if score > -np.inf  # Fewer live items than n_similar
+                ]
+
+        return similar_content
+
+    def recommend_content(self, user_profile, n_recommendations=10, filters=None):
+        """
+        Recommend content based on user profile
+
+        Args:
+            user_profile (dict): User profile with:
+                - liked_content: List of content IDs user liked
+                - disliked_content: List of content IDs user disliked
+                - preferred_genres: List of preferred genres (optional);
+                  only content with one of these genres is recommended
+            n_recommendations (int): Number of recommendations to generate
+            filters (dict): Metadata filter expression, e.g.
+                {'genres': ['Sci-Fi'], 'year': (2015, None)} (see
+                MetadataIndex). Matching content is looked up in the
+                metadata index and only those items are scored.
+
+        Returns:
+            list: List of (content_id, recommendation_score) tuples
+        """
+        if not user_profile.get('liked_content'):
+            return []
+
+        # Diversity re-ranks a larger pool of the most relevant candidates
+        n_candidates = n_recommendations
+        if self.diversity is not None:
+            n_candidates *= self.diversity_pool
+
+        # Calculate user preference vector. Item rows are unit length, so
+        # cosine similarity is a dot product with the normalized user vector
+        with self._stage('user_vector') as stage:
+            user_vector = self._calculate_user_vector(user_profile)
+            query = stage['output'] = _normalize(user_vector[None, :])[0]
+
+        top_indices, top_scores = self._search(query, user_profile, n_candidates, filters)
+
+        if self.diversity is not None:
+            with self._stage('diversity'):
+                top_indices, top_scores = self._diversify(
+                    top_indices, top_scores, n_recommendations)
+
+        return list(zip(self.content_index.idx_to_ids(top_indices).tolist(), top_scores))
+
+    def _search(self, query, user_profile, k, filters=None):
+        """
+        Top k positively scored content for a normalized query vector
+
+        Content seen in the profile is excluded and the profile's filters
+        apply. The filtered, ANN, int8 or exact path is chosen as described
+        in recommend_content.
+
+        Args:
+            query (np.ndarray): Unit-length query vector
+            user_profile (dict): Profile with liked/disliked content and
+                optional preferred_genres
+            k (int): Number of results
+            filters (dict): Metadata filter expression
+
+        Returns:
+            tuple: (indices, scores) sorted by descending score
+        """
+        # Exclude content user has already seen
+        seen_indices = self.content_index.ids_to_idx(
+            user_profile.get('liked_content', []) + user_profile.get('disliked_content', []))
+        seen_indices = seen_indices[seen_indices >= 0]
+
+        filters = self._profile_filters(user_profile, filters)
+        if filters:
+            # Score only the content that passes the filters
+            with self._stage('filtered_search'):
+                top_indices, top_scores = self._filtered_search(
+                    query, k, self._filter_mask(filters), seen_indices)
+        elif self.ann_index is not None:
+            # Score only the candidates returned by the ANN index
+            with self._stage('ann_search'):
+                top_indices, top_scores = self._ann_search(
+                    query, k, exclude=seen_indices)
+        elif self.quantized_features is not None:
+            # Shortlist with int8 scores and rescore it in full precision
+            with self._stage('quantized_search'):
+                top_indices, top_scores = self._quantized_search(
+                    query, k, exclude=seen_indices)
+        else:
+            # Calculate similarity between user vector and all content
+            with self._stage('scoring') as stage:
+                content_scores = stage['output'] = _dot(self.content_features, query)
+
+            # Mask seen and removed content and select the top recommendations
+            with self._stage('top_k'):
+                top_indices, top_scores = _top_k(
+                    content_scores, k,
+                    exclude=np.concatenate([seen_indices, self.removed_indices]))
+
+        # Only include positive scores
+        positive = top_scores > 0
+        return top_indices[positive], top_scores[positive]
+
+    def _diversify(self, indices, scores, k):
+        """
+        Re-rank a candidate pool for diversity and keep k results
+
+        Args:
+            indices (np.ndarray): Candidate rows sorted by descending score
+            scores (np.ndarray): Relevance score per candidate
+            k (int): Number of results
+
+        Returns:
+            tuple: (indices, scores) of the picked candidates in pick order
+        """
+        if len(indices) <= 1:
+            return indices[:k], scores[:k]
+
+        if self.diversity == 'category':
+            if self.metadata_index is None:
+                raise ValueError("No metadata index, fit with prepare_content_data first")
+            labels = self.metadata_index.row_labels(self.diversity_field, indices)
+            picked = _category_cap(labels, k, self.max_per_category)
+        else:
+            picked = _mmr(scores, self._pool_similarity(indices), k,
+                          self.diversity_lambda)
+
+        return indices[picked], scores[picked]
+
+    def _pool_similarity(self, indices):
+        """
+        Pairwise similarity of a candidate pool
+
+        Read from the similarity matrix when it was precomputed. Otherwise
+        the pool's feature rows are multiplied, which costs pool x pool x d
+        instead of another pass over the catalog. Top-K neighbor lists are
+        not used: most pool pairs are missing from them, and guessing those
+        changed about half of the MMR picks.
+        """
+        if self.similarity_matrix is not None:
+            return np.asarray(self.similarity_matrix[np.ix_(indices, indices)],
+                              dtype=np.float32)
+
+        rows = self.content_features[indices]
+        if _issparse(rows):
+            return (rows @ rows.T).toarray().astype(np.float32)
+        rows = rows.astype(np.float32)
+        return rows @ rows.T
+
+    def _profile_filters(self, user_profile, filters):
+        """Filter expression of a request, including preferred_genres"""
+        filters = dict(filters or {})
+        preferred_genres = user_profile.get('preferred_genres')
+        if (preferred_genres and 'genres' not in filters
+                and self.metadata_index is not None
+                and 'genres' in self.metadata_index.labels):
+            filters['genres'] = preferred_genres
+        return filters
+
+    def _filter_mask(self, filters):
+        """Row bitmap of live content matching a filter expression"""
+        if self.metadata_index is None:
+            raise ValueError("No metadata index, fit with prepare_content_data first")
+        mask = self.metadata_index.mask(filters)
+        mask[self.removed_indices] = False
+        return mask
+
+    def _filtered_search(self, query, k, mask, exclude=()):
+        """Top k of the rows allowed by a filter mask"""
+        mask[np.asarray(exclude, dtype=np.intp)] = False
+        candidates = np.flatnonzero(mask)
+
+        if len(candidates) * 4 < len(mask):
+            # Selective filter: gather and score only the matching rows
+            scores = _dot(self.content_features[candidates], query).ravel()
+            top, top_scores = _top_k(scores, k)
+            return candidates[top], top_scores
+
+        # Broad filter: one pass over the catalog is cheaper than a gather
+        scores = _dot(self.content_features, query)
+        top_indices, top_scores = _top_k(scores, k, exclude=np.flatnonzero(~mask))
+        keep = np.isfinite(top_scores)
+        return top_indices[keep], top_scores[keep]
+
+    def recommend_content_batch(self, profiles, n_recommendations=10, block_size=256,
+                                filters=None):
+        """
+        Recommend content for many user profiles at once
+
+        User vectors are stacked into a matrix and scored against the catalog
+        with one matrix product per block of users, so peak memory is bounded
+        by block_size x n_items scores.
+
+        Args:
+            profiles (list): User profiles, same format as recommend_content
+            n_recommendations (int): Number of recommendations per user
+            block_size (int): Users scored per matrix product
+            filters (dict): Metadata filter expression applied to every
+                profile, combined with each profile's preferred_genres
+
+        Returns:
+            list: One list of (content_id, recommendation_score) tuples per
+                profile, in the same order as profiles
+        """
+        recommendations = [[] for _ in profiles]
+        active = [i for i, profile in enumerate(profiles)
+                  if profile.get('liked_content')]
+        if not active:
+            return recommendations
+
+        k = n_recommendations
+        if self.diversity is not None:
+            k *= self.diversity_pool
+        # Masks of the filter expressions seen so far, shared across users
+        filter_masks = {}
+
+        for block_start in range(0, len(active), block_size):
+            block = active[block_start:block_start + block_size]
+
+            with self._stage('user_vector') as stage:
+                user_matrix = stage['output'] = _normalize(np.vstack([
+                    self._calculate_user_vector(profiles[i]) for i in block]))
+
+            top_indices, top_scores = self._score_users(
+                user_matrix, [profiles[i] for i in block], k, filters, filter_masks)
+
+            if self.diversity is not None:
+                # Re-rank every user's positive candidates for diversity
+                with self._stage('diversity'):
+                    for row, i in enumerate(block):
+                        positive = top_scores[row] > 0
+                        rows, scores = self._diversify(
+                            top_indices[row][positive], top_scores[row][positive],
+                            n_recommendations)
+                        recommendations[i] = list(zip(
+                            self.content_index.idx_to_ids(rows).tolist(), scores))
+                continue
+
+            top_ids = self.content_index.idx_to_ids(top_indices).tolist()
+            for row, i in enumerate(block):
+                recommendations[i] = [
+                    (content_id, score)
+                    for content_id, score in zip(top_ids[row], top_scores[row])
+                    if score > 0  # Only include positive scores
+                ]
+
+        return recommendations
+
+    def _score_users(self, user_matrix, profiles, k, filters=None, filter_masks=None):
+        """
+        Top k content for a block of normalized user vectors
+
+        Args:
+            user_matrix (np.ndarray): One unit-length user vector per row
+            profiles (list): The users' profiles; their seen content is
+                excluded and their preferred_genres filter applied
+            k (int): Results per user
+            filters (dict): Metadata filter expression for every user
+            filter_masks (dict): Cache of filter masks shared across calls
+
+        Returns:
+            tuple: (indices, scores) of shape (users, k) sorted by
+                descending score; slots without a live item score -inf
+        """
+        features = self.content_features
+        k = min(k, features.shape[0])
+        if filter_masks is None:
+            filter_masks = {}
+
+        # (n_items x d) @ (d x users) keeps sparse features on the left
+        with self._stage('scoring') as stage:
+            if self.quantized_features is not None:
+                block_scores = (_dot(self.quantized_features, user_matrix.T).T
+                                * self.quantization_scales)
+            else:
+                block_scores = _dot(features, user_matrix.T).T
+            stage['output'] = block_scores
+
+        # Translate every user's seen content with one lookup and mask it in
+        # a single scatter
+        seen = [profile.get('liked_content', []) + profile.get('disliked_content', [])
+                for profile in profiles]
+        seen_rows = np.repeat(np.arange(len(profiles)), [len(ids) for ids in seen])
+        seen_cols = self.content_index.ids_to_idx(
+            [content_id for ids in seen for content_id in ids])
+        found = seen_cols >= 0
+        block_scores[seen_rows[found], seen_cols[found]] = -np.inf
+        block_scores[:, self.removed_indices] = -np.inf
+
+        for row, profile in enumerate(profiles):
+            profile_filters = self._profile_filters(profile, filters)
+            if profile_filters:
+                key = repr(sorted(profile_filters.items()))
+                if key not in filter_masks:
+                    filter_masks[key] = self._filter_mask(profile_filters)
+                block_scores[row, ~filter_masks[key]] = -np.inf
+
+        with self._stage('top_k'):
+            if self.quantized_features is not None:
+                return self._rescore_rows(block_scores, user_matrix, k)
+            return _top_k_rows(block_scores, k)
+
+    def _rescore_rows(self, block_scores, user_matrix, k):
+        """Rescore every user's int8 shortlist exactly and keep the top k"""
+        n_shortlist = min(k * self.rescore_factor, block_scores.shape[1])
+        shortlist, shortlist_scores = _top_k_rows(block_scores, n_shortlist)
+
+        # Slots without enough live items keep a -inf score and are dropped
+        top_indices = np.zeros((len(block_scores), k), dtype=np.intp)
+        top_scores = np.full((len(block_scores), k), -np.inf, dtype=np.float32)
+        for row in range(len(block_scores)):
+            rows = np.sort(shortlist[row][np.isfinite(shortlist_scores[row])])
+            exact = _dot(self.content_features[rows], user_matrix[row]).ravel()
+            top, scores = _top_k(exact, k)
+            top_indices[row, :len(top)] = rows[top]
+            top_scores[row, :len(top)] = scores
+
+        return top_indices, top_scores
+
+    def _calculate_user_vector(self, user_profile):
+        """Calculate user preference vector based on liked content"""
+        user_id = user_profile.get('user_id')
+        history_version = user_profile.get('history_version')
+        if not self.user_cache_size or user_id is None or history_version is None:
+            # Without a version there is no way to tell a stale entry apart
+            return self._user_vector(self._user_state(user_profile))
+
+        state = self._user_cache.get(user_id)
+        if state is not None and state['history_version'] == history_version:
+            self._user_cache.move_to_end(user_id)
+            self.user_cache_stats['hits'] += 1
+            return self._user_vector(state)
+
+        self.user_cache_stats['misses'] += 1
+        state = self._user_state(user_profile)
+        state['history_version'] = history_version
+        self._user_cache[user_id] = state
+        self._user_cache.move_to_end(user_id)
+        if len(self._user_cache) > self.user_cache_size:
+            self._user_cache.popitem(last=False)
+
+        return self._user_vector(state)
+
+    def _user_state(self, user_profile):
+        """Sums and counts of liked/disliked feature rows of a profile"""
+        state = {}
+        for kind in ('liked', 'disliked'):
+            indices = self.content_index.ids_to_idx(user_profile.get(f'{kind}_content', []))
+            indices = indices[indices >= 0]
+            if len(indices):
+                # Works for dense and CSR rows
+                total = np.asarray(self.content_features[indices].sum(
+                    axis=0, dtype=np.float32)).ravel()
+            else:
+                total = np.zeros(self.content_features.shape[1], dtype=np.float32)
+            state[f'{kind}_sum'] = total
+            state[f'n_{kind}'] = len(indices)
+        return state
+
+    def _user_vector(self, state):
+        """Average liked vector minus half the average disliked vector"""
+        if not state['n_liked']:
+            return np.zeros(self.content_features.shape[1], dtype=np.float32)
+        return _preference_vector(state)
+
+    def record_interaction(self, user_id, content_id, liked=True,
+                           history_version=None):
+        """
+        Fold a single like or dislike into a cached user vector in O(d)
+
+        Call this alongside appending content_id to the user's liked or
+        disliked list, passing the new history_version, so the next request
+        is a cache hit instead of a full recompute.
+
+        Args:
+            user_id: User whose cached vector is updated
+            content_id: Content the user liked or disliked
+            liked (bool): True for a like, False for a dislike
+            history_version: History version after this interaction
+                (without one the cached vector is dropped)
+
+        Returns:
+            bool: Whether a cached vector was updated (False if the user was
+                not cached; the next request then recomputes it)
+        """
+        if history_version is None:
+            self._user_cache.pop(user_id, None)
+            return False
+
+        state = self._user_cache.get(user_id)
+        if state is None:
+            return False
+
+        kind = 'liked' if liked else 'disliked'
+        content_idx = self.content_index.ids_to_idx([content_id])[0]
+        if content_idx >= 0:
+            state[f'{kind}_sum'] += self._item_vector(content_idx)
+            state[f'n_{kind}'] += 1
+
+        state['history_version'] = history_version
+        self._user_cache.move_to_end(user_id)
+        return True
+
+    def explain_recommendation(self, content_id, user_profile):
+        """
+        Explain why content was recommended to a user
+
+        Args:
+            content_id: Recommended content ID
+            user_profile (dict): User profile
+
+        Returns:
+            dict: Explanation with key features and similar liked content
+        """
+        return self.explain_recommendations([content_id], user_profile)[0]
+
+    def explain_recommendations(self, content_ids, user_profile, n_similar_liked=3):
+        """
+        Explain a whole page of recommendations at once
+
+        All results are scored against all liked content with a single
+        (results x liked) product, and the user vector comes from the user
+        cache when enabled.
+
+        Args:
+            content_ids (list): Recommended content IDs
+            user_profile (dict): User profile
+            n_similar_liked (int): Liked items reported per result (at
+                least 1)
+
+        Returns:
+            list: One dict per content ID (empty for unknown content or a
+                profile without known liked content) with:
+                - most_similar_liked / similarity_score / explanation: the
+                  single closest liked item, as in explain_recommendation
+                - similar_liked: top (liked_content_id, similarity) pairs
+                - feature_contributions: part of the recommendation score
+                  contributed by each feature group (text, categorical,
+                  numerical); the parts sum to the score. Empty when the
+                  features are reduced (reduction_dim).
+        """
+        if n_similar_liked < 1:
+            raise ValueError(f"Invalid n_similar_liked: {n_similar_liked}")
+
+        explanations = [{} for _ in content_ids]
+
+        liked_indices = self.content_index.ids_to_idx(user_profile.get('liked_content', []))
+        liked_indices = liked_indices[liked_indices >= 0]
+        result_indices = self.content_index.ids_to_idx(content_ids)
+        positions = np.flatnonzero(result_indices >= 0)
+        result_indices = result_indices[positions]
+        if not len(liked_indices) or not len(positions):
+            return explanations
+
+        liked_ids = self.content_index.idx_to_ids(liked_indices).tolist()
+
+        result_features = self.content_features[result_indices]
+        if not _issparse(result_features):
+            result_features = result_features.astype(np.float32)
+
+        # (results x liked) similarities in one product
+        similarities = _dot(self.content_features[liked_indices], result_features.T).T
+        top, top_scores = _top_k_rows(similarities, min(n_similar_liked, len(liked_ids)))
+
+        # Per-group part of the score: item . user_vector over the group's columns
+        query = _normalize(self._calculate_user_vector(user_profile)[None, :])[0]
+        contributions = {group: _dot(result_features[:, start:end], query[start:end])
+                         for group, (start, end) in self.feature_groups.items()}
+
+        for row, position in enumerate(positions):
+            most_similar_content_id = liked_ids[top[row, 0]]
+            explanations[position] = {
+                'most_similar_liked': most_similar_content_id,
+                'similarity_score': top_scores[row, 0],
+                'explanation': f"Recommended because you liked {most_similar_content_id}",
+                'similar_liked': [(liked_ids[i], score)
+                                  for i, score in zip(top[row], top_scores[row])],
+                'feature_contributions': {group: float(scores[row])
+                                          for group, scores in contributions.items()},
+            }
+
+        return explanations
+
+    def memory_usage(self):
+        """
+        Bytes held by the fitted arrays and the user cache
+
+        Memory-mapped arrays count at their full size, the most page cache
+        they can pin once every page has been read. The fitted encoders are
+        not counted.
+
+        Returns:
+            int: Total size in bytes
+        """
+        arrays = [self.content_features, self.similarity_matrix, self.neighbor_indices,
+                  self.neighbor_scores, self.quantized_features, self.quantization_scales,
+                  self.reduction_components, self.removed_indices]
+        arrays += [getattr(self.content_index, name) for name in ContentIdIndex.ARRAYS]
+        if self.ann_index is not None:
+            arrays += [getattr(self.ann_index, name) for name in self.ann_index.ARRAYS]
+        if self._metadata_arrays is not None:
+            arrays += list(self._metadata_arrays[0].values())
+        elif self._metadata_index is not None:
+            arrays += [postings for _, postings in self._metadata_index.labels.values()]
+            arrays += [array for numerical in self._metadata_index.numerical.values()
+                       for array in numerical]
+            arrays += list(self._metadata_index._row_labels.values())
+
+        total = sum(_nbytes(array) for array in arrays if array is not None)
+        for state in self._user_cache.values():
+            total += state['liked_sum'].nbytes + state['disliked_sum'].nbytes
+        return total
+
+    def save(self, path):
+        """
+        Save the fitted recommender to a directory
+
+        Arrays (features, neighbor tables, ID index, ANN index) are
+        written as .npy files, CSR features as their data/indices/indptr
+        components, next to a small manifest.json. The fitted text and
+        genre encoders are pickled separately; they are only needed to add
+        or update content.
+
+        Args:
+            path (str): Output directory (created if missing)
+        """
+        if self.content_features is None:
+            raise ValueError("Call prepare_content_data before saving")
+
+        os.makedirs(path, exist_ok=True)
+
+        arrays = {f'content_{name}': getattr(self.content_index, name)
+                  for name in ContentIdIndex.ARRAYS}
+        arrays['removed_indices'] = self.removed_indices
+        if _issparse(self.content_features):
+            arrays['content_features.data'] = self.content_features.data
+            arrays['content_features.indices'] = self.content_features.indices
+            arrays['content_features.indptr'] = self.content_features.indptr
+        else:
+            arrays['content_features'] = self.content_features
+
+        for name in ('similarity_matrix', 'neighbor_indices', 'neighbor_scores'):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+
+        if self.ann_index is not None:
+            for name in self.ann_index.ARRAYS:
+                arrays[f'ann.{name}'] = getattr(self.ann_index, name)
+
+        if self.quantized_features is not None:
+            arrays['quantized_features'] = self.quantized_features
+            arrays['quantization_scales'] = self.quantization_scales
+
+        if self.reduction_components is not None:
+            arrays['reduction_components'] = self.reduction_components
+
+        if self.metadata_index is not None:
+            for field, (vocabulary, postings) in self.metadata_index.labels.items():
+                vocabulary = _id_array(vocabulary.to_numpy())
+                if vocabulary.dtype == object:
+                    if len(vocabulary):
+                        raise ValueError(f"Labels of {field} must be all strings or all "
+                                         f"numbers to be saved")
+                    vocabulary = vocabulary.astype(str)
+                arrays[f'metadata.{field}.vocabulary'] = vocabulary
+                arrays[f'metadata.{field}.indptr'] = postings.indptr
+                arrays[f'metadata.{field}.indices'] = postings.indices
+            for field, numerical in self.metadata_index.numerical.items():
+                for name, array in zip(('values', 'order', 'sorted_values'), numerical):
+                    arrays[f'metadata.{field}.{name}'] = array
+
+        for name, array in arrays.items():
+            array_path = os.path.join(path, f'{name}.npy')
+            if self._stream_arrays.get(name) is array and _is_mapped_from(array, array_path):
+                continue  # Written by prepare_content_stream and never modified
+            # A copy-on-write map of the target may hold in-place changes
+            # (tombstones, repaired neighbors), so never truncate the file it
+            # is read from: write a new file and swap it in
+            tmp_path = f'{array_path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            os.replace(tmp_path, array_path)
+
+        if self._encoders_path is not None:
+            # Loaded model whose encoders were never read: copy them verbatim
+            with open(self._encoders_path, 'rb') as f:
+                encoders = f.read()
+        else:
+            encoders = pickle.dumps((self.tfidf_vectorizer, self.categorical_encoder))
+        with open(os.path.join(path, 'encoders.pkl'), 'wb') as f:
+            f.write(encoders)
+
+        manifest = {
+            'format_version': 1,
+            'content_type': self.content_type,
+            'sparse': self.sparse,
+            'feature_dtype': self.feature_dtype.name,
+            'feature_shape': list(self.content_features.shape),
+            'label_delimiter': self.label_delimiter,
+            'ann_backend': self.ann_backend,
+            'ann_params': self.ann_params,
+            'quantization': self.quantization,
+            'rescore_factor': self.rescore_factor,
+            'reduction_dim': self.reduction_dim,
+            'diversity': self.diversity,
+            'diversity_lambda': self.diversity_lambda,
+            'diversity_pool': self.diversity_pool,
+            'diversity_field': self.diversity_field,
+            'max_per_category': self.max_per_category,
+            'text_columns': self.text_columns,
+            'categorical_columns': self.categorical_columns,
+            'max_categories': self.max_categories,
+            'category_hash_buckets': self.category_hash_buckets,
+            'filter_columns': self.filter_columns,
+            'metadata_fields': (self.metadata_fields
+                                if self.metadata_index is not None else None),
+            'numerical_columns': self.numerical_columns,
+            'numerical_mean': float(self.numerical_mean),
+            'numerical_std': float(self.numerical_std),
+            'feature_groups': self.feature_groups,
+            'arrays': sorted(arrays),
         }
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a recommender written by save()
+
+        Args:
+            path (str): Directory written by save()
+            mmap (bool): Memory-map the arrays copy-on-write instead of
+                reading them. Forked workers then share one copy of the
+                pages, and in-place updates stay private to the process.
+
+        Returns:
+            ContentBasedRecommender: The loaded recommender
+        """
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        if manifest.get('format_version') != 1:
+            raise ValueError(f"Unsupported model format: {manifest.get('format_version')}")
+
+        recommender = cls(content_type=manifest['content_type'],
+                          sparse=manifest['sparse'],
+                          ann_backend=manifest['ann_backend'],
+                          ann_params=manifest['ann_params'],
+                          feature_dtype=manifest['feature_dtype'],
+                          label_delimiter=manifest['label_delimiter'],
+                          quantization=manifest.get('quantization'),
+                          rescore_factor=manifest.get('rescore_factor', 4),
+                          reduction_dim=manifest.get('reduction_dim'),
+                          diversity=manifest.get('diversity'),
+                          diversity_lambda=manifest.get('diversity_lambda', 0.7),
+                          diversity_pool=manifest.get('diversity_pool', 4),
+                          diversity_field=manifest.get('diversity_field', 'genres'),
+                          max_per_category=manifest.get('max_per_category', 2),
+                          max_categories=manifest.get('max_categories'),
+                          category_hash_buckets=manifest.get('category_hash_buckets', 0),
+                          filter_columns=manifest.get('filter_columns'))
+
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'),
+                                mmap_mode='c' if mmap else None, allow_pickle=False)
+                  for name in manifest['arrays']}
+
+        if 'content_features' not in arrays:
+            recommender.content_features = sp.csr_matrix(
+                (arrays['content_features.data'], arrays['content_features.indices'],
+                 arrays['content_features.indptr']),
+                shape=tuple(manifest['feature_shape']))
+        else:
+            recommender.content_features = arrays['content_features']
+
+        for name in ('similarity_matrix', 'neighbor_indices', 'neighbor_scores',
+                     'quantized_features', 'quantization_scales', 'reduction_components'):
+            setattr(recommender, name, arrays.get(name))
+
+        if manifest['ann_backend'] is not None:
+            recommender.ann_index = ANN_BACKENDS[manifest['ann_backend']](
+                **manifest['ann_params'])
+            for name in recommender.ann_index.ARRAYS:
+                setattr(recommender.ann_index, name, arrays[f'ann.{name}'])
+
+        recommender.removed_indices = np.asarray(arrays['removed_indices'])
+
+        if manifest.get('metadata_fields') is not None:
+            # Built on first filtered request, which imports pandas and SciPy
+            recommender.metadata_fields = manifest['metadata_fields']
+            recommender._metadata_arrays = (
+                {name: array for name, array in arrays.items()
+                 if name.startswith('metadata.')},
+                manifest['feature_shape'][0])
+        recommender.content_index = ContentIdIndex.from_arrays(
+            *(arrays[f'content_{name}'] for name in ContentIdIndex.ARRAYS))
+
+        recommender.text_columns = manifest['text_columns']
+        recommender.categorical_columns = manifest['categorical_columns']
+        recommender.numerical_columns = manifest['numerical_columns']
+        recommender.numerical_mean = manifest['numerical_mean']
+        recommender.numerical_std = manifest['numerical_std']
+        recommender.feature_groups = {group: tuple(bounds) for group, bounds
+                                      in manifest['feature_groups'].items()}
+        recommender._encoders_path = os.path.join(path, 'encoders.pkl')
+
+        return recommender
+
+
+class MicroBatcher:
+    """
+    asyncio serving front end that micro-batches recommender calls
+
+    Requests that arrive within max_wait_ms of the oldest queued request
+    are merged, up to max_batch_size, into one recommend_content_batch (per
+    distinct n_recommendations and filters) or get_similar_content_batch
+    call, and every caller's future is resolved with its own slice.
+    Batches run on a single worker thread: the event loop keeps accepting
+    requests while a batch is scored (NumPy releases the GIL inside matrix
+    products) and the recommender is never called concurrently.
+    Recommendations are those of recommend_content_batch,
+    which scores exactly (or through quantized features) and does not use
+    an ANN index.
+
+    Example:
+        async with MicroBatcher(recommender, max_wait_ms=2) as batcher:
+            recommendations = await batcher.recommend_content(profile, 10)
+    """
+
+    def __init__(self, recommender, max_batch_size=64, max_wait_ms=2.0):
+        """
+        Args:
+            recommender (ContentBasedRecommender): Fitted recommender
+            max_batch_size (int): Most requests merged into one call
+            max_wait_ms (float): Longest a request waits for others to
+                join its batch, bounding the added latency
+        """
+        self.recommender = recommender
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.stats = {'requests': 0, 'batches': 0}
+        self._pending = {}
+        self._wakeup = {}
+        self._workers = []
+        self._executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        """Start the batching workers on the running event loop"""
+        if self._workers:
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        handlers = {'recommend': self._recommend_batch, 'similar': self._similar_batch}
+        for kind, handler in handlers.items():
+            self._pending[kind] = deque()
+            self._wakeup[kind] = asyncio.Event()
+            self._workers.append(asyncio.create_task(self._run(kind, handler)))
+
+    async def stop(self):
+        """Stop the workers; requests still queued are cancelled"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        for pending in self._pending.values():
+            while pending:
+                _, future, _ = pending.popleft()
+                future.cancel()
+        self._pending = {}
+        self._wakeup = {}
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def recommend_content(self, user_profile, n_recommendations=10, filters=None):
+        """Batched recommend_content; same arguments and result"""
+        return await self._submit('recommend', (user_profile, n_recommendations, filters))
+
+    async def get_similar_content(self, content_id, n_similar=10):
+        """Batched get_similar_content; same arguments and result"""
+        return await self._submit('similar', (content_id, n_similar))
+
+    def _submit(self, kind, request):
+        """Queue a request and return the future its result is set on"""
+        if kind not in self._pending:
+            raise RuntimeError("MicroBatcher is not running, use 'async with' or start()")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[kind].append((request, future, loop.time()))
+        self._wakeup[kind].set()
+        self.stats['requests'] += 1
+        return future
+
+    async def _run(self, kind, handler):
+        """Collect batches of one request kind and score them"""
+        loop = asyncio.get_running_loop()
+        pending, wakeup = self._pending[kind], self._wakeup[kind]
+
+        while True:
+            await wakeup.wait()
+
+            # Wait for more requests until the batch is full or the oldest
+            # request has waited max_wait_ms
+            deadline = pending[0][2] + self.max_wait_ms / 1000
+            while len(pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [pending.popleft()
+                     for _ in range(min(len(pending), self.max_batch_size))]
+            if pending:
+                wakeup.set()
+            else:
+                wakeup.clear()
+
+            # Callers may have given up (e.g. a request timeout) meanwhile
+            batch = [(request, future) for request, future, _ in batch
+                     if not future.done()]
+            if not batch:
+                continue
+
+            self.stats['batches'] += 1
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, handler, [request for request, _ in batch])
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _recommend_batch(self, requests):
+        """
+        Score recommend_content requests with one batched call per distinct
+        n_recommendations and filter expression. Diversity pools and
+        quantized shortlists depend on n, so a longer list cut short would
+        not match recommend_content.
+        """
+        groups = {}
+        for position, (_, n, filters) in enumerate(requests):
+            # repr keeps (low, high) ranges apart from lists of labels
+            key = (n, repr(sorted(filters.items())) if filters else None)
+            groups.setdefault(key, []).append(position)
+
+        results = [None] * len(requests)
+        for positions in groups.values():
+            _, n, filters = requests[positions[0]]
+            group_results = self.recommender.recommend_content_batch(
+                [requests[position][0] for position in positions], n,
+                block_size=self.max_batch_size, filters=filters or None)
+            for position, result in zip(positions, group_results):
+                results[position] = result
+        return results
+
+    def _similar_batch(self, requests):
+        """Score get_similar_content requests with one batched call"""
+        n_max = max(n for _, n in requests)
+        results = self.recommender.get_similar_content_batch(
+            [content_id for content_id, _ in requests], n_max,
+            block_size=self.max_batch_size)
+        return [result[:n] for result, (_, n) in zip(results, requests)]
+
+
+def _no_delay(connection):
+    """
+    Disable Nagle's algorithm on a socket connection
+
+    Connection.send writes the length header and a large payload
+    separately, and Nagle plus delayed ACKs would then stall every round
+    trip by tens of milliseconds.
+    """
+    sock = socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    finally:
+        sock.close()  # Closes the duplicate descriptor only
+    return connection
+
+
+class _ShardHandler:
+    """Requests a ShardedRecommender sends to one shard"""
+
+    def __init__(self, recommender):
+        self.recommender = recommender
+
+    def state(self, profiles):
+        """Liked/disliked feature sums and counts over this shard's content"""
+        return [self.recommender._user_state(profile) for profile in profiles]
+
+    def vectors(self, content_ids):
+        """Feature rows of the content IDs held by this shard"""
+        indices = self.recommender.content_index.ids_to_idx(content_ids)
+        found = indices >= 0
+        rows = self.recommender.content_features[indices[found]]
+        rows = rows.toarray() if _issparse(rows) else np.asarray(rows)
+        return found, rows.astype(np.float32)
+
+    def search(self, queries, profiles, k, filters):
+        """Top k of this shard for one query, as recommend_content scores it"""
+        indices, scores = self.recommender._search(queries[0], profiles[0], k, filters)
+        return [(self.recommender.content_index.idx_to_ids(indices), scores)]
+
+    def search_batch(self, queries, profiles, k, filters, block_size):
+        """Top k of this shard per query, as recommend_content_batch scores them"""
+        results = []
+        filter_masks = {}
+        for start in range(0, len(profiles), block_size):
+            top_indices, top_scores = self.recommender._score_users(
+                queries[start:start + block_size], profiles[start:start + block_size],
+                k, filters, filter_masks)
+            for indices, scores in zip(top_indices, top_scores):
+                positive = scores > 0
+                results.append((self.recommender.content_index.idx_to_ids(indices[positive]),
+                                scores[positive]))
+        return results
+
+
+def serve_shard(model_path, authkey, address=('127.0.0.1', 0), ready=None):
+    """
+    Serve one saved shard to a ShardedRecommender until it sends 'close'
+
+    Run one per shard, either in a local worker process (as
+    ShardedRecommender.launch does) or on another node, passing the
+    addresses to ShardedRecommender. Requests are pickled over a
+    multiprocessing.connection socket, authenticated with authkey. The key
+    is required: without one, anyone reaching the port could send pickles.
+
+    Args:
+        model_path (str): Directory written by ContentBasedRecommender.save
+            for one of the recommenders returned by shard()
+        authkey (bytes): Shared secret the coordinator must present, e.g.
+            os.urandom(32)
+        address (tuple): (host, port) to listen on; port 0 picks a free port
+        ready (callable): Called with the bound (host, port) once listening
+    """
+    if not authkey:
+        raise ValueError("serve_shard requires a non-empty authkey")
+
+    handler = _ShardHandler(ContentBasedRecommender.load(model_path))
+
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready(listener.address)
+
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue  # Failed handshake, e.g. a wrong authkey
+
+            with _no_delay(connection):
+                while True:
+                    try:
+                        kind, request_id, *args = connection.recv()
+                    except (OSError, EOFError):
+                        break  # Coordinator went away; wait for the next one
+                    if kind == 'close':
+                        return
+
+                    try:
+                        reply = (request_id, True, getattr(handler, kind)(*args))
+                    except Exception as e:
+                        reply = (request_id, False, e)
+                    connection.send(reply)
+
+
+# Started in a fresh interpreter by ShardedRecommender.launch; the template
+# file name is not importable, so the module is loaded from its path
+_SHARD_SERVER_SCRIPT = """
+import importlib.util, json, sys
+spec = importlib.util.spec_from_file_location('content_based_filtering', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+authkey = bytes.fromhex(sys.stdin.readline().strip())
+module.serve_shard(sys.argv[2], authkey=authkey,
+                   ready=lambda address: print(json.dumps(address), flush=True))
+"""
+
+
+class ShardedRecommender:
+    """
+    Scatter-gather coordinator over recommender shards run by serve_shard
+
+    A request takes two round trips. Every shard first returns the
+    liked/disliked feature sums of the profile content it holds, which add
+    up to the user vector over the whole catalog. The normalized user
+    vector is then sent to every shard, each returns its own top k, and
+    the sorted lists are merged with a heap. Results are those of one
+    recommender over the whole catalog, except that diversity re-ranking
+    is not applied.
+
+    With a timeout, shards that have not answered a round trip in time are
+    left out and the result covers the others: last_missing_shards lists
+    them and stats counts partial results. A shard that misses the first
+    round trip still gets the second, so a request takes at most twice the
+    timeout. Calls must not overlap; put a MicroBatcher in front of the
+    coordinator for concurrent callers.
+
+    Example:
+        with ShardedRecommender.launch(recommender, 4, 'shards/', timeout=0.05) as sharded:
+            recommendations = sharded.recommend_content(profile, 10)
+    """
+
+    def __init__(self, addresses, authkey, timeout=None):
+        """
+        Args:
+            addresses (list): (host, port) of every shard server
+            authkey (bytes): Shared secret of the shard servers (required)
+            timeout (float): Seconds each round trip waits for the shards
+                before going on with the replies it has (default: wait for
+                all)
+        """
+        if not authkey:
+            raise ValueError("ShardedRecommender requires a non-empty authkey")
+
+        self.addresses = [tuple(address) for address in addresses]
+        self.timeout = timeout
+        self.connections = [_no_delay(Client(address, authkey=authkey))
+                            for address in self.addresses]
+        self.processes = []
+        self.stats = {'requests': 0, 'partial_results': 0,
+                      'shard_timeouts': [0] * len(self.addresses)}
+        self.last_missing_shards = []
+        self._request_id = 0
+
+    @classmethod
+    def launch(cls, recommender, n_shards, path, timeout=None):
+        """
+        Shard a fitted recommender, save the shards under path and serve
+        each one from its own worker process on this machine
+
+        Args:
+            recommender (ContentBasedRecommender): Fitted recommender
+            n_shards (int): Number of shards and worker processes
+            path (str): Directory for the shard models (shard_0, ...)
+            timeout (float): Per-request timeout, see __init__
+
+        Returns:
+            ShardedRecommender: Coordinator that stops the workers on close()
+        """
+        authkey = os.urandom(32)
+        processes = []
+        try:
+            for i, shard in enumerate(recommender.shard(n_shards)):
+                shard_path = os.path.join(path, f'shard_{i}')
+                shard.save(shard_path)
+                process = subprocess.Popen(
+                    [sys.executable, '-c', _SHARD_SERVER_SCRIPT, os.path.abspath(__file__),
+                     shard_path],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                processes.append(process)
+                # The key goes over stdin so it does not show up in ps
+                process.stdin.write(authkey.hex() + '\n')
+                process.stdin.close()
+
+            # Every worker prints its address once it is listening
+            addresses = []
+            for process in processes:
+                line = process.stdout.readline()
+                if not line:
+                    raise RuntimeError("Shard server failed to start")
+                addresses.append(tuple(json.loads(line)))
+
+            sharded = cls(addresses, authkey, timeout)
+        except BaseException:
+            for process in processes:
+                process.kill()
+            raise
+
+        sharded.processes = processes
+        return sharded
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Disconnect from the shards and stop the workers started by launch"""
+        for connection in self.connections:
+            if connection is None:
+                continue
+            if self.processes:
+                try:
+                    connection.send(('close', 0))
+                except OSError:
+                    pass
+            connection.close()
+        self.connections = []
+
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            process.stdout.close()
+        self.processes = []
+
+    def recommend_content(self, user_profile, n_recommendations=10, filters=None):
+        """Sharded recommend_content; same arguments and result"""
+        return self._recommend('search', [user_profile], n_recommendations, filters)[0]
+
+    def recommend_content_batch(self, profiles, n_recommendations=10, block_size=256,
+                                filters=None):
+        """Sharded recommend_content_batch; same arguments and result"""
+        return self._recommend('search_batch', profiles, n_recommendations, filters,
+                               block_size)
+
+    def get_similar_content(self, content_id, n_similar=10):
+        """
+        Sharded get_similar_content, scored by searching every shard with
+        the item's feature row; only positive similarities are returned
+        """
+        return self._similar('search', [content_id], n_similar)[0]
+
+    def get_similar_content_batch(self, content_ids, n_similar=10, block_size=256):
+        """Sharded get_similar_content_batch; see get_similar_content"""
+        return self._similar('search_batch', content_ids, n_similar, block_size)
+
+    def _recommend(self, kind, profiles, k, filters, *block_size):
+        """Gather user vectors from the shards, then scatter them for top k"""
+        self._start_request()
+        recommendations = [[] for _ in profiles]
+
+        # Only the content lists and preferred genres travel to the shards
+        active = [i for i, profile in enumerate(profiles) if profile.get('liked_content')]
+        requests = [{key: profiles[i][key] for key in
+                     ('liked_content', 'disliked_content', 'preferred_genres')
+                     if key in profiles[i]} for i in active]
+        if not requests:
+            return recommendations
+
+        states = [state for state in self._scatter('state', requests)
+                  if state is not None]
+        queries, queried = [], []
+        for row, i in enumerate(active):
+            state = {name: sum(shard_states[row][name] for shard_states in states)
+                     for name in ('liked_sum', 'n_liked', 'disliked_sum', 'n_disliked')}
+            if state['n_liked']:
+                queries.append(_preference_vector(state))
+                queried.append(row)
+        if not queries:
+            return recommendations
+
+        results = self._scatter(kind, _normalize(np.vstack(queries)),
+                                [requests[row] for row in queried], k, filters,
+                                *block_size)
+        for row, merged in zip(queried, self._merge(results, k)):
+            recommendations[active[row]] = merged
+        return recommendations
+
+    def _similar(self, kind, content_ids, k, *block_size):
+        """Gather item rows from their shards, then scatter them for top k"""
+        self._start_request()
+        similar_content = [[] for _ in content_ids]
+
+        queries = [None] * len(content_ids)
+        for reply in self._scatter('vectors', content_ids):
+            if reply is not None:
+                found, rows = reply
+                for position, row in zip(np.flatnonzero(found), rows):
+                    queries[position] = row
+        queried = [position for position, query in enumerate(queries) if query is not None]
+        if not queried:
+            return similar_content
+
+        # The item itself is excluded like seen content
+        results = self._scatter(kind, np.vstack([queries[position] for position in queried]),
+                                [{'liked_content': [content_ids[position]]}
+                                 for position in queried],
+                                k, None, *block_size)
+        for position, merged in zip(queried, self._merge(results, k)):
+            similar_content[position] = merged
+        return similar_content
+
+    def _start_request(self):
+        """Count a request and reset the shards it is missing"""
+        self.stats['requests'] += 1
+        self.last_missing_shards = []
+
+    def _scatter(self, kind, *args):
+        """
+        Send a request to every shard and collect the replies that arrive
+        within the timeout
+
+        Returns:
+            list: Reply per shard, None for shards that did not answer
+        """
+        self._request_id += 1
+        request_id = self._request_id
+        pending = {}
+        for shard, connection in enumerate(self.connections):
+            if connection is None:
+                continue
+            try:
+                connection.send((kind, request_id) + args)
+                pending[connection] = shard
+            except OSError:
+                self._disconnect(shard)
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        replies = [None] * len(self.connections)
+        while pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = wait(list(pending), remaining)
+            if not ready:
+                break
+            for connection in ready:
+                try:
+                    reply_id, ok, result = connection.recv()
+                except (OSError, EOFError):
+                    self._disconnect(pending.pop(connection))
+                    continue
+                if reply_id != request_id:
+                    continue  # Late reply to a request that timed out
+                shard = pending.pop(connection)
+                if not ok:
+                    raise result
+                replies[shard] = result
+
+        for shard in pending.values():
+            self.stats['shard_timeouts'][shard] += 1
+
+        missing = [shard for shard, reply in enumerate(replies) if reply is None]
+        if missing:
+            if not self.last_missing_shards:
+                self.stats['partial_results'] += 1
+            self.last_missing_shards = sorted(set(self.last_missing_shards) | set(missing))
+        return replies
+
+    def _disconnect(self, shard):
+        """Stop sending to a shard whose connection failed"""
+        self.connections[shard].close()
+        self.connections[shard] = None
+
+    @staticmethod
+    def _merge(results, k):
+        """Merge every query's per-shard top k lists into one top k"""
+        results = [result for result in results if result is not None]
+        merged = []
+        for per_shard in zip(*results):
+            ranked = heapq.merge(*[zip(ids.tolist(), scores) for ids, scores in per_shard],
+                                 key=lambda item: item[1], reverse=True)
+            merged.append([item for _, item in zip(range(k), ranked)])
+        return merged
+
+
+class RecommenderRegistry:
+    """
+    Per-project recommenders loaded on demand within a memory budget
+
+    Every project has a snapshot written by save() under root/<project_id>.
+    get() returns the resident recommender (a hit) or loads the snapshot,
+    memory-mapped by default, so a cold project costs a load instead of a
+    fit (a miss). When the resident models exceed memory_budget, the least
+    recently used ones are dropped; models registered with put(...,
+    save=False) are written back to their snapshot first.
+
+    Sizes come from ContentBasedRecommender.memory_usage() and are taken
+    when a project is loaded, so growth of a resident model (user cache,
+    metadata index built on first filtered request) is counted at the next
+    load. The project just requested is never evicted, even on its own over
+    budget. get() may be called from several threads; concurrent requests
+    for one cold project share a single load, and snapshot writes
+    (write-backs, factory fits) run outside the registry lock so they never
+    stall requests for other projects.
+
+    Example:
+        registry = RecommenderRegistry('models/', memory_budget=8 << 30)
+        recommendations = registry.get(project_id).recommend_content(profile, 10)
+    """
+
+    def __init__(self, root, memory_budget=None, mmap=True, factory=None,
+                 max_latencies=1024):
+        """
+        Args:
+            root (str): Directory holding one snapshot per project
+            memory_budget (int): Bytes the resident models may use
+                (default: no limit, nothing is evicted)
+            mmap (bool): Load snapshots memory-mapped, see
+                ContentBasedRecommender.load
+            factory (callable): Called as factory(project_id) to fit a
+                project without a snapshot; the result is saved (default:
+                such projects raise KeyError)
+            max_latencies (int): Recent load times kept in load_latencies
+        """
+        self.root = root
+        self.memory_budget = memory_budget
+        self.mmap = mmap
+        self.factory = factory
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'fits': 0, 'evictions': 0,
+                      'write_backs': 0, 'load_total_s': 0.0, 'load_max_s': 0.0}
+        self.load_latencies = deque(maxlen=max_latencies)
+        # project_id -> [recommender, bytes, unsaved changes], least
+        # recently used first
+        self._resident = OrderedDict()
+        self._loading = {}
+        # Evicted projects being written back: project_id -> (recommender,
+        # pending writes)
+        self._writing = {}
+        self._lock = threading.Lock()
+        # Snapshot writes take this lock only, so gets are never blocked
+        self._write_lock = threading.Lock()
+
+    def __contains__(self, project_id):
+        return (project_id in self._resident
+                or os.path.exists(os.path.join(self._path(project_id), 'manifest.json')))
+
+    @property
+    def resident_projects(self):
+        """Resident project IDs, least recently used first"""
+        return list(self._resident)
+
+    @property
+    def resident_bytes(self):
+        """Memory of the resident models as last measured"""
+        return sum(entry[1] for entry in list(self._resident.values()))
+
+    def get(self, project_id):
+        """
+        Recommender of a project, loading (or fitting) it on a miss
+
+        Args:
+            project_id (str): Project ID
+
+        Returns:
+            ContentBasedRecommender: The project's recommender
+        """
+        with self._lock:
+            entry = self._resident.get(project_id)
+            if entry is not None:
+                self._resident.move_to_end(project_id)
+                self.stats['hits'] += 1
+                return entry[0]
+
+            writing = self._writing.get(project_id)
+            if writing is not None:
+                # Evicted but still being written back: take it back as is
+                self.stats['hits'] += 1
+                recommender = writing[0]
+                evicted = self._admit(project_id, recommender, changes=1)
+            else:
+                self.stats['misses'] += 1
+                future = self._loading.get(project_id)
+                loader = future is None
+                if loader:
+                    future = self._loading[project_id] = Future()
+
+        if writing is not None:
+            self._write_back(evicted)
+            return recommender
+        if not loader:
+            return future.result()
+
+        evicted = []
+        try:
+            start = time.perf_counter()
+            recommender, fitted = self._load(project_id)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stats['fits' if fitted else 'loads'] += 1
+                self.load_latencies.append(elapsed)
+                self.stats['load_total_s'] += elapsed
+                self.stats['load_max_s'] = max(self.stats['load_max_s'], elapsed)
+                evicted = self._admit(project_id, recommender, changes=0)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[project_id]
+
+        future.set_result(recommender)
+        self._write_back(evicted)
+        return recommender
+
+    def put(self, project_id, recommender, save=True):
+        """
+        Register a fitted (or updated) recommender as a resident project
+
+        Args:
+            project_id (str): Project ID
+            recommender (ContentBasedRecommender): Fitted recommender
+            save (bool): Write the snapshot now; otherwise it is written
+                when the project is evicted or flush() is called
+        """
+        self._path(project_id)  # Validate before registering
+        while True:
+            with self._lock:
+                future = self._loading.get(project_id)
+                if future is None:
+                    entry = self._resident.get(project_id)
+                    changes = entry[2] + 1 if entry is not None else 1
+                    evicted = self._admit(project_id, recommender, changes)
+                    break
+            # A load must not read the snapshot while it is replaced; its
+            # outcome does not matter, the new model supersedes it
+            future.exception()
+
+        self._write_back(evicted)
+        if save:
+            self._save(project_id, recommender, changes)
+
+    def evict(self, project_id):
+        """
+        Drop a resident project, writing it back first if it has unsaved
+        changes
+
+        Args:
+            project_id (str): Project ID
+
+        Returns:
+            bool: Whether the project was resident
+        """
+        with self._lock:
+            entry = self._resident.pop(project_id, None)
+            if entry is None:
+                return False
+            evicted = self._evicted(project_id, entry)
+        self._write_back(evicted)
+        return True
+
+    def flush(self):
+        """Write back every resident project with unsaved changes"""
+        with self._lock:
+            dirty = [(project_id, entry[0], entry[2])
+                     for project_id, entry in self._resident.items() if entry[2]]
+        for project_id, recommender, changes in dirty:
+            self._save(project_id, recommender, changes)
+            with self._lock:
+                self.stats['write_backs'] += 1
+
+    def _path(self, project_id):
+        """Snapshot directory of a project"""
+        project_id = str(project_id)
+        if (not project_id or project_id.startswith('.') or os.sep in project_id
+                or (os.altsep and os.altsep in project_id)):
+            raise ValueError(f"Invalid project ID: {project_id!r}")
+        return os.path.join(self.root, project_id)
+
+    def _load(self, project_id):
+        """
+        Load a project's snapshot, or fit and save it with the factory
+
+        Returns:
+            tuple: (recommender, whether it was fitted)
+        """
+        path = self._path(project_id)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            return ContentBasedRecommender.load(path, mmap=self.mmap), False
+        if self.factory is None:
+            raise KeyError(f"No snapshot for project: {project_id}")
+
+        recommender = self.factory(project_id)
+        with self._write_lock:
+            self._write(project_id, recommender)
+        return recommender, True
+
+    def _admit(self, project_id, recommender, changes):
+        """
+        Make a project resident and evict others down to the budget (called
+        with the lock held)
+
+        Args:
+            changes (int): Unsaved changes of the recommender (0 if the
+                snapshot is current)
+
+        Returns:
+            list: Evicted (project_id, recommender) pairs to pass to
+                _write_back once the lock is released
+        """
+        self._resident[project_id] = [recommender, recommender.memory_usage(), changes]
+        self._resident.move_to_end(project_id)
+        if self.memory_budget is None:
+            return []
+
+        evicted = []
+        total = sum(entry[1] for entry in self._resident.values())
+        while total > self.memory_budget and len(self._resident) > 1:
+            evicted_id, entry = self._resident.popitem(last=False)
+            total -= entry[1]
+            evicted += self._evicted(evicted_id, entry)
+        return evicted
+
+    def _evicted(self, project_id, entry):
+        """
+        Count an eviction and, if the project has unsaved changes, keep it
+        reachable until it is written back (called with the lock held)
+        """
+        self.stats['evictions'] += 1
+        if not entry[2]:
+            return []
+        recommender = entry[0]
+        _, pending = self._writing.get(project_id, (recommender, 0))
+        self._writing[project_id] = (recommender, pending + 1)
+        return [(project_id, recommender)]
+
+    def _write_back(self, evicted):
+        """Write evicted projects with unsaved changes to their snapshots"""
+        for project_id, recommender in evicted:
+            try:
+                with self._write_lock:
+                    self._write(project_id, recommender)
+            finally:
+                with self._lock:
+                    self.stats['write_backs'] += 1
+                    _, pending = self._writing[project_id]
+                    if pending > 1:
+                        self._writing[project_id] = (recommender, pending - 1)
+                    else:
+                        del self._writing[project_id]
+
+    def _save(self, project_id, recommender, changes):
+        """Write a resident project and mark it saved unless it changed since"""
+        with self._write_lock:
+            self._write(project_id, recommender)
+        with self._lock:
+            entry = self._resident.get(project_id)
+            if entry is not None and entry[0] is recommender and entry[2] == changes:
+                entry[2] = 0
+
+    def _write(self, project_id, recommender):
+        """
+        Save a snapshot next to the current one and swap it in (called
+        with the write lock held, not the registry lock, so gets proceed)
+
+        The model being saved may be memory-mapped from the current
+        snapshot, so its files are never overwritten in place: they are
+        unlinked after the swap and stay readable through existing maps.
+        """
+        path = self._path(project_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        old_path = f'{tmp_path}.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        recommender.save(tmp_path)
+
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if recommender._encoders_path is not None:
+            recommender._encoders_path = os.path.join(path, 'encoders.pkl')
+        shutil.rmtree(old_path, ignore_errors=True)
 
 
 def example_usage():